@@ -0,0 +1,227 @@
+import argparse, json, os, random, resource, subprocess, sys, tempfile, time
+import mock_bold
+
+## end-to-end throughput benchmark of the identification engines against the local mock server
+## every case runs in its own process, so the peak memory of one case does not hide the next
+## results can be saved and compared against a saved baseline to catch regressions
+
+MARKERS = ["coi", "its", "rbcl"]
+BATCH_SIZES = {"coi": 50, "its": 10, "rbcl": 5}
+
+
+## function to write a fasta with random sequences, a share of them are duplicates
+def make_fasta(path, records, duplicates=0.1, length=658):
+    generator = random.Random(records)
+    sequences = []
+
+    with open(path, "w") as output:
+        for number in range(records):
+            if sequences and generator.random() < duplicates:
+                sequence = generator.choice(sequences)
+            else:
+                sequence = "".join(generator.choice("ACGT") for _ in range(length))
+                sequences.append(sequence)
+            output.write(">OTU_{}\n{}\n".format(number + 1, sequence))
+
+
+## function to read the io counters of the current process, only available on linux
+def io_counters():
+    try:
+        with open("/proc/self/io", "r") as counters:
+            counters = dict(line.split(": ") for line in counters.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+## function to run a single case, called in a fresh process by run_case
+def case(marker, fasta_path, output_path, batch_size):
+    from boldigger import http_pool, pipeline, markers
+
+    engine = markers.engine(marker)
+    session = http_pool.new_session()
+    http_pool.set_session(session)
+
+    read_before, written_before = io_counters()
+    start = time.perf_counter()
+    for kind, batch, message, finished in pipeline.identify(
+        engine, session, fasta_path, output_path, batch_size, use_cache=False
+    ):
+        pass
+    seconds = time.perf_counter() - start
+    read_after, written_after = io_counters()
+
+    return {
+        "seconds": round(seconds, 3),
+        "sequences_per_second": round(finished / seconds, 2),
+        "bytes_read": None if read_after is None else read_after - read_before,
+        "bytes_written": None
+        if written_after is None
+        else written_after - written_before,
+        ## ru_maxrss is given in kilobytes on linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+## function to run a case in a fresh process that talks to the mock server
+## rate_limit is the requests per second boldigger may send to the mock
+def run_case(server, marker, records, batch_size, workdir, rate_limit):
+    fasta_path = os.path.join(workdir, "{}_{}.fasta".format(marker, records))
+    output_path = os.path.join(workdir, "{}_{}".format(marker, records))
+    os.makedirs(output_path, exist_ok=True)
+    make_fasta(fasta_path, records)
+
+    ## the case process uses this checkout of boldigger and sends all requests to the mock
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(
+        os.environ,
+        BOLDIGGER_BASE_URL=server.url,
+        BOLDIGGER_RATE_LIMIT=str(rate_limit),
+        PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])),
+    )
+    sent_before = server.bytes_sent
+    process = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "case",
+            marker,
+            fasta_path,
+            output_path,
+            str(batch_size),
+        ],
+        env=environment,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+
+    result = {"marker": marker, "records": records, "batch_size": batch_size}
+    result.update(json.loads(process.stdout.decode().splitlines()[-1]))
+    result["network_bytes"] = server.bytes_sent - sent_before
+
+    return result
+
+
+## function to compare the results with a baseline
+## returns the cases that got slower than the tolerance allows
+def regressions(results, baseline, tolerance):
+    baseline = {
+        (result["marker"], result["records"]): result["sequences_per_second"]
+        for result in baseline
+    }
+
+    return [
+        result
+        for result in results
+        if (result["marker"], result["records"]) in baseline
+        and result["sequences_per_second"]
+        < baseline[(result["marker"], result["records"])] * (1 - tolerance)
+    ]
+
+
+## function to print the results as a table
+def print_table(results):
+    columns = [
+        "marker",
+        "records",
+        "sequences_per_second",
+        "seconds",
+        "network_bytes",
+        "bytes_read",
+        "bytes_written",
+        "peak_rss_mb",
+    ]
+    print(" ".join("{:>20}".format(column) for column in columns))
+    for result in results:
+        print(" ".join("{:>20}".format(str(result[column])) for column in columns))
+
+
+def main():
+    ## cases run in their own process, see run_case
+    if len(sys.argv) > 1 and sys.argv[1] == "case":
+        marker, fasta_path, output_path, batch_size = sys.argv[2:6]
+        print(json.dumps(case(marker, fasta_path, output_path, int(batch_size))))
+        return
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the identification engines."
+    )
+    parser.add_argument(
+        "--markers", nargs="+", choices=MARKERS, default=MARKERS
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--latency", type=float, default=0, help="Seconds per GET.")
+    parser.add_argument(
+        "--post-latency", type=float, default=0, help="Seconds per submitted sequence."
+    )
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--malformed-rate", type=float, default=0)
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=1000000,
+        help="Requests per second, the default does not limit the engine.",
+    )
+    parser.add_argument("--recordings", help="Folder of recorded result pages.")
+    parser.add_argument("--save", help="Save the results to this json file.")
+    parser.add_argument("--baseline", help="Compare the results with this json file.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed loss of throughput compared to the baseline.",
+    )
+    args = parser.parse_args()
+
+    server = mock_bold.start(
+        latency=args.latency,
+        post_latency=args.post_latency,
+        error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate,
+        recordings=args.recordings,
+    )
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for marker in args.markers:
+            for records in args.sizes:
+                results.append(
+                    run_case(
+                        server,
+                        marker,
+                        records,
+                        BATCH_SIZES[marker],
+                        workdir,
+                        args.rate_limit,
+                    )
+                )
+                print(
+                    "{} with {} records: {} sequences per second.".format(
+                        marker, records, results[-1]["sequences_per_second"]
+                    ),
+                    flush=True,
+                )
+
+    print_table(results)
+
+    if args.save:
+        with open(args.save, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as baseline:
+            slower = regressions(results, json.load(baseline), args.tolerance)
+        for result in slower:
+            print(
+                "Regression: {} with {} records is slower than the baseline.".format(
+                    result["marker"], result["records"]
+                )
+            )
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+import argparse, glob, hashlib, itertools, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+## local stand-in for boldsystems.org, answers every request BOLDigger sends
+## the pages are generated from the sequence hashes in the layout of the real BOLD pages,
+## so the same sequence always gets the same result
+
+## columns of the result tables, COI has a top 20, ITS and rbcL & matK a top 99 with scores
+COLUMNS = {
+    "COX1": [
+        "Phylum",
+        "Class",
+        "Order",
+        "Family",
+        "Genus",
+        "Species",
+        "Subspecies",
+        "Similarity",
+        "Status",
+    ],
+    "ITS": [
+        "Rank",
+        "Phylum",
+        "Class",
+        "Order",
+        "Family",
+        "Genus",
+        "Species",
+        "Subspecies",
+        "Score",
+        "Similarity",
+        "E_Value",
+        "Status",
+    ],
+}
+COLUMNS["MATK_RBCL"] = COLUMNS["ITS"]
+HITS = {"COX1": 20, "ITS": 99, "MATK_RBCL": 99}
+
+## statuses that are answered to simulate an overloaded server
+ERROR_STATUSES = [429, 500, 502, 503]
+
+
+## function to build a stable seed from any string
+def seed(value):
+    return int(hashlib.sha1(value.encode()).hexdigest()[:12], 16)
+
+
+## function to generate a taxonomy, the same number always gives the same taxonomy
+def taxonomy(number):
+    return [
+        "Phylum{}".format(number % 3),
+        "Class{}".format(number % 7),
+        "Order{}".format(number % 13),
+        "Family{}".format(number % 29),
+        "Genus{}".format(number % 61),
+        "species{}".format(number % 127),
+        "",
+    ]
+
+
+## function to generate the result page of one sequence
+def result_page(searchdb, seq_hash, no_match_rate):
+    generator = random.Random(seed(searchdb + seq_hash))
+
+    ## pages without a hit only contain the search table
+    if generator.random() < no_match_rate:
+        return "<html><body><table><tr><td>No match</td></tr></table></body></html>"
+
+    rows, records = [], []
+    for rank in range(1, HITS[searchdb] + 1):
+        status = generator.choice(
+            ["Published", "Published", "Private", "Early-Release"]
+        )
+        similarity = round(100 - rank * generator.random(), 2)
+        values = taxonomy(generator.randrange(10**6)) + [similarity, status]
+        if searchdb != "COX1":
+            values = (
+                [rank]
+                + values[:7]
+                + [round(similarity * 10, 1), similarity, "{:.2e}".format(rank * 1e-50)]
+                + [status]
+            )
+        rows.append(
+            "<tr>{}</tr>".format(
+                "".join("<td>{}</td>".format(value) for value in values)
+            )
+        )
+        if status == "Published":
+            records.append(
+                '<div class="publicrecord" id="MOCK{}-{}"></div>'.format(
+                    seq_hash[:8].upper(), rank
+                )
+            )
+
+    header = "<tr>{}</tr>".format(
+        "".join("<th>{}</th>".format(column) for column in COLUMNS[searchdb])
+    )
+
+    return (
+        "<html><body>"
+        "<table><tr><td>Search</td></tr></table>"
+        "<table>{}{}</table>"
+        "<table><tr><td>Summary</td></tr></table>"
+        "{}</body></html>"
+    ).format(header, "".join(rows), "".join(records))
+
+
+## function to generate the answer to an identification request, one result link per sequence
+def submission_page(searchdb, query):
+    sequences = [line.strip() for line in query.split("\n")[1::2]]
+    links = [
+        '<span style="text-decoration: none" result="/index.php/mock/result?db={}&amp;id={}">'
+        "Top 20</span>".format(
+            searchdb, hashlib.sha1(sequence.upper().encode()).hexdigest()
+        )
+        for sequence in sequences
+    ]
+
+    return "<html><body>{}</body></html>".format("".join(links))
+
+
+## function to generate the xml answer of the specimen api
+def specimen_xml(process_ids):
+    records = "".join(
+        "<record><processid>{0}</processid><record_id>{1}</record_id>"
+        "<bin_uri>BOLD:MOCK{2}</bin_uri><sex>female</sex><lifestage>adult</lifestage>"
+        "<country>Germany</country><identification_provided_by>Mock Identifier"
+        "</identification_provided_by><identification_method>Morphology"
+        "</identification_method><institution_storing>Mock Institute"
+        "</institution_storing></record>".format(
+            process_id, seed(process_id) % 10**8, seed(process_id) % 10**4
+        )
+        for process_id in process_ids
+    )
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><bold_records>{}</bold_records>'.format(
+            records
+        )
+    )
+
+
+## function to generate the json answer of the specimen api
+def specimen_json(process_ids):
+    records = {}
+    for process_id in process_ids:
+        names = taxonomy(seed(process_id))
+        records[process_id] = {
+            "processid": process_id,
+            "taxonomy": {
+                level: {"taxon": {"name": name}}
+                for level, name in zip(["phylum", "class", "order", "family"], names)
+            },
+        }
+
+    return json.dumps({"bold_records": {"records": records}})
+
+
+## function to generate the answer of the public species identification api
+def ids_xml(sequence):
+    generator = random.Random(seed(sequence))
+    matches = "".join(
+        "<match><ID>MOCK{0}</ID><sequencedescription>COI-5P</sequencedescription>"
+        "<database>COX1_SPECIES_PUBLIC</database><citation>Mock</citation>"
+        "<taxonomicidentification>Genus{1} species{1}</taxonomicidentification>"
+        "<similarity>{2}</similarity></match>".format(
+            index, generator.randrange(3), round(1 - index * 0.001, 4)
+        )
+        for index in range(20)
+    )
+
+    return '<?xml version="1.0" encoding="UTF-8"?><matches>{}</matches>'.format(matches)
+
+
+## request handler, the settings of the server are reached via self.server
+class MockBoldHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    ## function to send a response and count the bytes for the benchmark
+    def answer(self, body, content_type="text/html", status=200, headers=()):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(len(body))
+
+    ## function to simulate latency, errors and malformed pages as configured
+    ## returns True if the request has already been answered
+    def disturb(self, latency):
+        time.sleep(latency)
+
+        if self.server.random() < self.server.error_rate:
+            status = self.server.choice(ERROR_STATUSES)
+            headers = [("Retry-After", "1")] if status == 429 else []
+            self.answer("Server busy", status=status, headers=headers)
+            return True
+        if self.server.random() < self.server.malformed_rate:
+            self.answer("<html><body><p>Service temporarily unavailable")
+            return True
+        return False
+
+    def do_GET(self):
+        address = urlsplit(self.path)
+        query = {key: value[0] for key, value in parse_qs(address.query).items()}
+
+        if address.path in ("", "/"):
+            links = "".join("<a>Link</a>" for _ in range(5)) + "<a>Log out</a>"
+            return self.answer(
+                '<html><body><ul class="site-navigation nav navbar-nav">{}</ul>'
+                "</body></html>".format(links)
+            )
+        if self.disturb(self.server.latency):
+            return
+        if address.path == "/index.php/mock/result":
+            return self.answer(self.server.result(query["db"], query["id"]))
+        if address.path == "/index.php/API_Public/specimen":
+            process_ids = query.get("ids", "").split("|")
+            if query.get("format") == "json":
+                return self.answer(specimen_json(process_ids), "application/json")
+            return self.answer(specimen_xml(process_ids), "text/xml")
+        if address.path == "/index.php/Ids_xml":
+            return self.answer(ids_xml(query.get("sequence", "")), "text/xml")
+
+        self.answer("Not found", status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = {
+            key: value[0]
+            for key, value in parse_qs(self.rfile.read(length).decode()).items()
+        }
+        self.server.count(length, received=True)
+
+        if self.path == "/index.php/Login":
+            return self.answer("<html><body>Welcome</body></html>")
+        if self.path not in (
+            "/index.php/IDS_IdentificationRequest",
+            "/index.php/IDS_BlastRequest",
+        ):
+            return self.answer("Not found", status=404)
+
+        ## oversized batches are rejected like on the real server
+        sequences = form.get("sequence", "").count(">")
+        if sequences > self.server.max_batch:
+            return self.answer("Request Entity Too Large", status=413)
+        if self.disturb(self.server.post_latency * sequences):
+            return
+
+        self.answer(submission_page(form["searchdb"], form.get("sequence", "")))
+
+
+## server holding the settings and counters of the mock
+class MockBoldServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        latency=0,
+        post_latency=0,
+        error_rate=0,
+        malformed_rate=0,
+        no_match_rate=0.05,
+        max_batch=100,
+        recordings=None,
+    ):
+        super().__init__(address, MockBoldHandler)
+        self.latency, self.post_latency = latency, post_latency
+        self.error_rate, self.malformed_rate = error_rate, malformed_rate
+        self.no_match_rate, self.max_batch = no_match_rate, max_batch
+        self.bytes_sent, self.bytes_received = 0, 0
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+
+        ## recorded result pages of the real BOLD are served in turn instead of generated ones
+        pages = sorted(glob.glob("{}/*.html".format(recordings))) if recordings else []
+        self._recordings = itertools.cycle(
+            [open(page, "rb").read() for page in pages]
+        )
+        self._recorded = bool(pages)
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def choice(self, values):
+        with self._lock:
+            return self._random.choice(values)
+
+    def count(self, size, received=False):
+        with self._lock:
+            if received:
+                self.bytes_received += size
+            else:
+                self.bytes_sent += size
+
+    def result(self, searchdb, seq_hash):
+        if self._recorded:
+            with self._lock:
+                return next(self._recordings)
+        return result_page(searchdb, seq_hash, self.no_match_rate)
+
+
+## function to start a mock server in a background thread, returns the server
+def start(**settings):
+    server = MockBoldServer(**settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+## run the mock server on its own, e.g. to point a manual BOLDigger run at it
+## via the BOLDIGGER_BASE_URL environment variable
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for boldsystems.org.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds per GET.")
+    parser.add_argument(
+        "--post-latency", type=float, default=0, help="Seconds per submitted sequence."
+    )
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--malformed-rate", type=float, default=0)
+    parser.add_argument("--no-match-rate", type=float, default=0.05)
+    parser.add_argument("--max-batch", type=int, default=100)
+    parser.add_argument("--recordings", help="Folder of recorded result pages.")
+    args = parser.parse_args()
+
+    server = MockBoldServer(
+        ("127.0.0.1", args.port),
+        args.latency,
+        args.post_latency,
+        args.error_rate,
+        args.malformed_rate,
+        args.no_match_rate,
+        args.max_batch,
+        args.recordings,
+    )
+    print("Mock BOLD server running on {}".format(server.url), flush=True)
+    server.serve_forever()
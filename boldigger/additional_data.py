@@ -1,119 +1,176 @@
-import openpyxl, requests_html, datetime
+import openpyxl, datetime, os, io
+import pandas as pd
 import PySimpleGUI as sg
-from more_itertools import unique_everseen
+from concurrent.futures import as_completed
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from requests.exceptions import RequestException
 from boldigger.boldblast_coi import slices
-from bs4 import BeautifulSoup as BSoup
+from boldigger import http_pool, specimen_cache, specimen_store
+from lxml import etree
+
+## tags of a specimen record in the answer of the specimen API, in the order of the output columns
+TAGS = [
+    "record_id",
+    "bin_uri",
+    "sex",
+    "lifestage",
+    "country",
+    "identification_provided_by",
+    "identification_method",
+    "institution_storing",
+]
 
 
 ## funtion to scan the BOLDresutls file and return a list
-## of all unique Process ID's found, will also return the workbook
-## ato later use it when saving the data
+## of all unique Process ID's found
 ## as well as what type of result were dealing with (coi or its/rbl)
+## the file is streamed in read only mode and only the Process ID column is read
 def retrieve_process_ids(xlsx_path):
     ## open resultsfile and worksheet
-    wb = openpyxl.load_workbook(xlsx_path)
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True)
     sheet = wb.active
 
-    ## get type (coi or its/rbcl) and extract process ids
-    if sheet.cell(row=1, column=11).value == "Process ID":
-        type = "coi"
-        process_ids = [
-            sheet.cell(row=row, column=11).value
-            for row in range(2, sheet.max_row + 1)
-            if sheet.cell(row=row, column=11).value != None
-            and sheet.cell(row=row, column=11).value != ""
-        ]
-    elif sheet.cell(row=1, column=11).value == "Similarity":
-        type = "its_rbcl"
-        process_ids = [
-            sheet.cell(row=row, column=14).value
-            for row in range(2, sheet.max_row + 1)
-            if sheet.cell(row=row, column=14).value != None
-            and sheet.cell(row=row, column=14).value != ""
-        ]
+    ## get type (coi or its/rbcl) from the header
+    header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+    if len(header) > 10 and header[10] == "Process ID":
+        type, column = "coi", 11
+    elif len(header) > 10 and header[10] == "Similarity":
+        type, column = "its_rbcl", 14
     else:
+        wb.close()
         raise ValueError
 
-    ## remove duplicates and return
-    return wb, list(unique_everseen(process_ids)), type
+    ## collect the unique process ids in a single pass
+    process_ids = set()
+    for (process_id,) in sheet.iter_rows(
+        min_row=2, min_col=column, max_col=column, values_only=True
+    ):
+        process_ids.add(process_id)
+    process_ids.difference_update({None, ""})
+
+    wb.close()
+
+    return list(process_ids), type
+
+
+## asynchronous request of the specimen data of a pack of process IDs
+## failed requests are repeated after a growing, jittered pause up to http_pool.max_attempts times
+## returns the raw xml answer of the API or None if all attempts failed
+async def as_specimens(id_pack):
+    url = http_pool.url(
+        "http://www.boldsystems.org/index.php/API_Public/specimen?ids="
+        + "|".join(id_pack)
+    )
+
+    for attempt in range(http_pool.max_attempts):
+        if attempt:
+            await http_pool.wait_backoff(attempt)
+        try:
+            resp = await http_pool.get(url, timeout=300)
+            resp.raise_for_status()
+            return resp.content
+        except RequestException:
+            continue
+
+    return None
 
 
 ## function to loop through the process IDs and call the BOLD API  for additional data
-## will return a dict in form of {Process ID: [BOLD Record ID, BIN, Sex, Life stage, Country, Identifier, Identification method, Institution storing]}
-def get_data(process_ids, processbar):
-    ## slice the process ids in parts of 100 to get the maximum out of API calls
-    process_ids = list(slices(process_ids, 100))
-
-    ## open a new html session
-    with requests_html.HTMLSession() as session:
-        ## initialize the final dict output
-        process_id_dict = {}
-
-        for id_pack in process_ids:
-            ## request the data, retry if the request failes
-            while True:
-                try:
-                    resp = session.get(
-                        "http://www.boldsystems.org/index.php/API_Public/specimen?ids="
-                        + "|".join(id_pack)
-                    )
-                except:
-                    continue
-                break
-
-            ## use beautifulsoup to find all records in the response
-            soup = BSoup(resp.text, "xml")
-            records = soup.find_all("record")
-
-            ## loop through records to extract interesting data
-            for count in range(len(records)):
-                tags = [
-                    "processid",
-                    "record_id",
-                    "bin_uri",
-                    "sex",
-                    "lifestage",
-                    "country",
-                    "identification_provided_by",
-                    "identification_method",
-                    "institution_storing",
-                ]
-
-                ## search the data encapsuled by each tag
-                specimen_data = [
-                    records[count].find(tag) if records[count].find(tag) != None else ""
-                    for tag in tags
-                ]
-
-                ## extract the texts from these tags
-                specimen_data = [
-                    datapoint.text if datapoint != "" else ""
-                    for datapoint in specimen_data
-                ]
-
-                ## append a link to the specimen page to the results if user is interested in looking up even more data
-                specimen_data.append(
-                    "http://www.boldsystems.org/index.php/MAS_DataRetrieval_OpenSpecimen?selectedrecordid="
-                    + specimen_data[1]
-                )
+## process IDs of an ingested data package are resolved offline from the specimen store
+## process IDs found in the specimen cache are not requested again, new records are added to it
+## the packs are requested at the same time, limited by the requests in flight of the http pool
+## all of them share the keep-alive connections of the shared session
+## will return a dict in form of {Process ID: [BOLD Record ID, BIN, Sex, Life stage, Country, Identifier, Identification method, Institution storing, Specimen page url]}
+## process IDs whose pack failed too often are missing in the dict, they are returned as a list of the failed packs
+def get_data(process_ids, processbar=None):
+    records = specimen_store.lookup(process_ids, TAGS)
+    cache = specimen_cache.open_cache()
+    records.update(
+        specimen_cache.load(
+            cache, [pid for pid in process_ids if pid not in records], TAGS
+        )
+    )
 
-                ## put the data in a dictionary in form of processID: [listofinformation]
-                process_dict = {specimen_data[0]: specimen_data[1:]}
+    ## slice the missing process ids in parts of 100 to get the maximum out of API calls
+    missing = [process_id for process_id in process_ids if process_id not in records]
+    id_packs = list(slices(missing, 100))
+    answers = {
+        http_pool.submit(as_specimens(id_pack)): id_pack for id_pack in id_packs
+    }
+    failed = []
 
-                ## update the final output
-                process_id_dict.update(process_dict)
+    ## the answers are parsed in the order they arrive
+    for finished, answer in enumerate(as_completed(answers), 1):
+        if answer.result() is None:
+            failed.append(answers[answer])
+        else:
+            downloaded = parse_specimens(answer.result())
+            specimen_cache.store(cache, downloaded)
+            records.update(downloaded)
 
-            processbar.UpdateBar(
-                round(100 / len(process_ids) * (process_ids.index(id_pack) + 1))
-            )
+        if processbar is not None:
+            processbar.UpdateBar(round(100 / len(id_packs) * finished))
+
+    if processbar is not None:
+        processbar.UpdateBar(100)
+
+    specimen_cache.evict(cache)
+    cache.close()
+
+    data = {process_id: specimen_row(record) for process_id, record in records.items()}
+
+    return data, failed
+
+
+## function to return the output columns of a specimen record
+## a link to the specimen page is appended if user is interested in looking up even more data
+def specimen_row(record):
+    row = [record.get(tag, "") for tag in TAGS]
+
+    return row + [
+        "http://www.boldsystems.org/index.php/MAS_DataRetrieval_OpenSpecimen?selectedrecordid="
+        + row[0]
+    ]
+
+
+## function to extract the additional data from an answer of the specimen API
+## the answer is parsed as a stream, every record is read in a single pass over its elements
+## and dropped right after, so the whole document is never held as a tree
+## returns a dict in form of {Process ID: {tag: text}}
+def parse_specimens(xml):
+    process_id_dict = {}
+
+    try:
+        for event, record in etree.iterparse(
+            io.BytesIO(xml), events=("end",), tag="record", recover=True
+        ):
+            ## the first element of every tag is used, like find would do
+            specimen_data, found = dict.fromkeys(["processid"] + TAGS, ""), set()
+            for element in record.iter(*specimen_data):
+                if element.tag not in found:
+                    found.add(element.tag)
+                    specimen_data[element.tag] = element.text or ""
+
+            ## drop the record and all records before it
+            record.clear()
+            while record.getprevious() is not None:
+                del record.getparent()[0]
+
+            ## put the data in a dictionary in form of processID: {tag: text}
+            process_id = specimen_data.pop("processid")
+            if process_id:
+                process_id_dict[process_id] = specimen_data
+    except etree.XMLSyntaxError:
+        pass
 
     return process_id_dict
 
 
 ## function to save the additional data to the input file
-def save_results(workbook, additional_data, xlsx_path, type):
-    sheet = workbook.active
-
+## the results are joined with the additional data on the Process ID in a single merge
+## and streamed into a new workbook, which replaces the input file once it is complete
+def save_results(additional_data, xlsx_path, type):
     ## headers to add to the resultfile
     headers = [
         "Record ID",
@@ -130,19 +187,44 @@ def save_results(workbook, additional_data, xlsx_path, type):
     ## first empty column depends on the type either 12 oder 15
     start = 12 if type == "coi" else 15
 
-    ## write the header row
-    for i in range(start, start + len(headers)):
-        sheet.cell(row=1, column=i).value = headers[i - start]
+    additional_data = pd.DataFrame.from_dict(
+        additional_data, orient="index", columns=headers
+    )
 
-    ## add the additional data to the resultfile
-    for row in range(2, sheet.max_row + 1):
-        for column in range(start, start + len(headers)):
-            if sheet.cell(row=row, column=start - 1).value in additional_data.keys():
-                sheet.cell(row=row, column=column).value = additional_data[
-                    sheet.cell(row=row, column=start - 1).value
-                ][column - start]
+    workbook = openpyxl.load_workbook(xlsx_path, read_only=True)
+    active = workbook.active.title
+    output = openpyxl.Workbook(write_only=True)
 
-    workbook.save(xlsx_path)
+    for name in workbook.sheetnames:
+        rows = workbook[name].iter_rows(values_only=True)
+        sheet = output.create_sheet(name)
+
+        ## all other sheets are copied as they are
+        if name != active:
+            for row in rows:
+                sheet.append(row)
+            continue
+
+        ## columns of an earlier download are replaced
+        header = next(rows)[: start - 1]
+        results = pd.DataFrame((row[: start - 1] for row in rows), columns=header)
+        results = results.join(additional_data, on=header[-1])
+
+        header = []
+        for column in results.columns:
+            cell = WriteOnlyCell(sheet, value=column)
+            cell.font = Font(bold=True)
+            header.append(cell)
+        sheet.append(header)
+
+        results = results.astype(object).where(results.notna(), None)
+        for row in results.itertuples(index=False, name=None):
+            sheet.append(row)
+
+    output.active = workbook.sheetnames.index(active)
+    workbook.close()
+    output.save(xlsx_path + ".tmp")
+    os.replace(xlsx_path + ".tmp", xlsx_path)
 
 
 ## main function to controll the flow
@@ -173,7 +255,7 @@ def main(xlsx_path):
         if not ran:
             ## catch any wrong file formats here to avoid crash
             try:
-                wb, process_ids, type = retrieve_process_ids(xlsx_path)
+                process_ids, type = retrieve_process_ids(xlsx_path)
             except ValueError:
                 window["out"].print("Wrong file format. Close to continue.")
 
@@ -183,14 +265,25 @@ def main(xlsx_path):
                 % datetime.datetime.now().strftime("%H:%M:%S")
             )
             window.Refresh()
-            additional_data = get_data(process_ids, bar)
+            additional_data, failed = get_data(process_ids, bar)
+
+            ## tell the user about process ids that could not be downloaded
+            if failed:
+                window["out"].print(
+                    "%s: %d requests failed, %d process ID's have no additional data."
+                    % (
+                        datetime.datetime.now().strftime("%H:%M:%S"),
+                        len(failed),
+                        sum(len(id_pack) for id_pack in failed),
+                    )
+                )
 
             ## saving the data according to type
             window["out"].print(
                 "%s: Saving the results." % datetime.datetime.now().strftime("%H:%M:%S")
             )
             window.Refresh()
-            save_results(wb, additional_data, xlsx_path, type)
+            save_results(additional_data, xlsx_path, type)
 
         ran = True
 
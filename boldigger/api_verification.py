@@ -1,14 +1,19 @@
-import datetime, contextlib, requests_html, joblib, json, openpyxl, psutil, lxml
+import datetime, contextlib, io, joblib, json, openpyxl, lxml
 import PySimpleGUI as sg
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
 from joblib import Parallel, delayed
 from Bio.SeqIO.FastaIO import SimpleFastaParser
+from requests.exceptions import RequestException
 from boldigger.boldblast_coi import slices
+from boldigger import http_pool, specimen_cache, specimen_store
 from string import punctuation
 from string import digits
 
+## higher taxonomy that is requested from the specimen api
+TAXONOMY = ["phylum", "class", "order", "family"]
+
 
 ## function to make tqdm work with parallelized code
 @contextlib.contextmanager
@@ -56,23 +61,27 @@ def extract_data(xlsx_path, fasta_path):
 
 ## function to send a request to the bold species identification api
 ## item is a dict entry from the seq_dict {OTU: Sequence}
+## returns None if the request failed or there is no hit, so one failure does not stop the others
 def request(item, session):
-    ## request BOLD API
-    r = session.get(
-        "http://boldsystems.org/index.php/Ids_xml?db=COX1_SPECIES_PUBLIC&sequence={}".format(
-            item[1]
-        )
-    )
     try:
-        r = pd.read_xml(r.text)
+        ## request BOLD API
+        r = http_pool.get_with_retries(
+            session,
+            http_pool.url(
+                "http://boldsystems.org/index.php/Ids_xml?db=COX1_SPECIES_PUBLIC&sequence={}".format(
+                    item[1]
+                )
+            ),
+        )
+        r = pd.read_xml(io.StringIO(r.text))
         ## this is the species name
         most_common = (
             r.loc[r["similarity"] >= 0.98]["taxonomicidentification"].mode().item()
         )
         ## look up BOLD ID to query API again in case of missing higher taxonomic identification
-        bold_id = r.loc[r["taxonomicidentification"] == most_common].iloc[0][0]
+        bold_id = r.loc[r["taxonomicidentification"] == most_common].iloc[0, 0]
         return item[0], most_common, bold_id
-    except (ValueError, lxml.etree.XMLSyntaxError):
+    except (ValueError, lxml.etree.XMLSyntaxError, RequestException):
         return None
 
 
@@ -121,35 +130,61 @@ def refresh_data(result, raw_data, data_to_check, session):
     bold_ids = {
         k: v for k, v in bold_ids.items() if k in remaining_data["ID"].to_list()
     }
-    id_values = list(slices(list(bold_ids.values()), 100))
 
-    ## collect responses here
-    responses = []
+    ## taxonomy of an ingested data package or the specimen cache is not requested again
+    taxonomy = specimen_store.lookup(set(bold_ids.values()), TAXONOMY)
+    cache = specimen_cache.open_cache()
+    taxonomy.update(
+        specimen_cache.load(
+            cache, set(bold_ids.values()).difference(taxonomy), TAXONOMY
+        )
+    )
+    missing = [bold_id for bold_id in set(bold_ids.values()) if bold_id not in taxonomy]
+    id_values = list(slices(missing, 100))
+
     ## request ids
     for id_pack in id_values:
-        r = session.get(
-            "http://www.boldsystems.org/index.php/API_Public/specimen?ids={}&format=json".format(
-                "|".join(id_pack)
-            )
-        )
         try:
+            r = http_pool.get_with_retries(
+                session,
+                http_pool.url(
+                    "http://www.boldsystems.org/index.php/API_Public/specimen?ids={}&format=json".format(
+                        "|".join(id_pack)
+                    )
+                ),
+            )
             r = json.loads(r.text)["bold_records"]["records"]
-            ## loop through the ids of the response, collect data, append to responses, handle responses with missing data
-            for key in id_pack:
-                ## create an temporary list to collect the data
-                temp = []
-                for tax_level in ["phylum", "class", "order", "family"]:
-                    try:
-                        temp.append(r[key]["taxonomy"][tax_level]["taxon"]["name"])
-                    except KeyError:
-                        temp.append(np.nan)
-                responses.append(temp)
-        # handle empty json response
-        except json.decoder.JSONDecodeError:
-            temp = []
-            for _ in range(4):
-                temp.append(np.nan)
-            responses.append(temp)
+        # handle empty json response and failed requests, the taxonomy of the pack stays empty
+        except (ValueError, KeyError, TypeError, RequestException):
+            continue
+
+        ## loop through the ids of the response, collect data, handle responses with missing data
+        downloaded = {}
+        for key in id_pack:
+            if key not in r:
+                continue
+            downloaded[key] = {}
+            for tax_level in TAXONOMY:
+                try:
+                    name = r[key]["taxonomy"][tax_level]["taxon"]["name"]
+                except KeyError:
+                    name = None
+                downloaded[key][tax_level] = name
+
+        specimen_cache.store(cache, downloaded)
+        taxonomy.update(downloaded)
+
+    specimen_cache.evict(cache)
+    cache.close()
+
+    ## collect the taxonomy in the order of the remaining data, missing levels stay empty
+    responses = [
+        [
+            taxonomy.get(bold_ids.get(otu), {}).get(tax_level) or np.nan
+            for tax_level in TAXONOMY
+        ]
+        for otu in remaining_data["ID"]
+    ]
 
     ## write the additional taxonomic information to a new dataframe and concat it to the one that's missing the data
     additional_tax = pd.DataFrame(
@@ -230,12 +265,13 @@ def main(xlsx_path, fasta_path):
                 )
                 window.Refresh()
 
-                session = requests_html.HTMLSession()
+                ## use the shared session, threads are used so all workers reuse its connections
+                session = http_pool.get_session()
 
                 with tqdm_joblib(
                     tqdm(desc="Calling API", total=len(list(seq_dict.items())))
                 ) as progress_bar:
-                    result = Parallel(n_jobs=psutil.cpu_count())(
+                    result = Parallel(n_jobs=http_pool.max_in_flight, prefer="threads")(
                         delayed(request)(item, session)
                         for item in list(seq_dict.items())
                     )
@@ -0,0 +1,64 @@
+import os
+
+## post requests that take longer than this number of seconds shrink the batch size
+slow = float(os.environ.get("BOLDIGGER_SLOW_POST", 300))
+
+## post requests that are answered faster than this number of seconds grow the batch size
+fast = float(os.environ.get("BOLDIGGER_FAST_POST", 60))
+
+## number of fast answers in a row that are needed before the batch size grows again
+streak = 3
+
+
+## function to change the latency limits, has to be called before a run is started
+def configure(slow_latency=None, fast_latency=None):
+    global slow, fast
+
+    slow = slow_latency if slow_latency is not None else slow
+    fast = fast_latency if fast_latency is not None else fast
+
+
+## function to start a new controller, the batch size starts at the maximum given by the user
+def new_controller(maximum, minimum=1):
+    return {"size": maximum, "minimum": minimum, "maximum": maximum, "fast": 0}
+
+
+## function to return the current batch size, passed to fasta_reader.fasta_batches
+def size(controller):
+    return controller["size"]
+
+
+## function to set a new batch size within the limits of the controller
+## returns True if the batch size has changed
+def resize(controller, new_size):
+    old_size = controller["size"]
+    controller["size"] = max(
+        controller["minimum"], min(controller["maximum"], int(new_size))
+    )
+
+    return controller["size"] != old_size
+
+
+## function to adapt the batch size after BOLD answered a request of sequences in latency seconds
+## slow answers shrink the batch size by a quarter, some fast answers in a row grow it by a tenth
+def succeeded(controller, sequences, latency):
+    if latency > slow:
+        controller["fast"] = 0
+        return resize(controller, min(controller["size"], sequences) * 0.75)
+
+    ## only full batches tell if BOLD could handle a larger one
+    if latency < fast and sequences >= controller["size"]:
+        controller["fast"] += 1
+        if controller["fast"] >= streak:
+            controller["fast"] = 0
+            return resize(
+                controller, controller["size"] + max(1, controller["size"] // 10)
+            )
+    return False
+
+
+## function to adapt the batch size after a request of sequences timed out or was rejected
+## the batch size drops to half of the failed request, so the next batches are small enough for BOLD to answer
+def failed(controller, sequences):
+    controller["fast"] = 0
+    return resize(controller, min(controller["size"], sequences // 2))
@@ -0,0 +1,207 @@
+import os, json, ntpath
+from itertools import islice
+from boldigger import fasta_reader
+
+
+## function to return the path of the journal that belongs to a run
+## the journal is saved next to the results, the input fasta is never touched
+def journal_path(fasta_path, output_path):
+    savename = "BOLDResults_{}.journal".format(
+        ntpath.splitext(ntpath.basename(fasta_path))[0]
+    )
+
+    return os.path.join(output_path, savename)
+
+
+## function to return the path of the list of result pages that could not be downloaded
+def failed_path(fasta_path, output_path):
+    savename = "BOLDResults_{}.failed".format(
+        ntpath.splitext(ntpath.basename(fasta_path))[0]
+    )
+
+    return os.path.join(output_path, savename)
+
+
+## function to return the path of the result links the running identification has received
+def links_path(fasta_path, output_path):
+    savename = "BOLDResults_{}.links".format(
+        ntpath.splitext(ntpath.basename(fasta_path))[0]
+    )
+
+    return os.path.join(output_path, savename)
+
+
+## function to return the path the downloaded pages of a run are kept in if the
+## identification cache is not used, it has the layout of the identification cache
+def pages_path(fasta_path, output_path):
+    savename = "BOLDResults_{}.pages".format(
+        ntpath.splitext(ntpath.basename(fasta_path))[0]
+    )
+
+    return os.path.join(output_path, savename)
+
+
+## function to start a new journal
+def new_journal(fasta_path):
+    return {
+        "fasta": os.path.abspath(fasta_path),
+        "start": 0,
+        "offset": 0,
+        "batches": 0,
+        "records": 0,
+        "rows": 0,
+        "hashes": [],
+        "finished": False,
+    }
+
+
+## function to check if the fasta still starts with the records the journal has seen
+## the records of the last finished batch have to end exactly at the saved offset
+def matches(journal, fasta_path):
+    records = list(
+        islice(
+            fasta_reader.read_records(fasta_path, journal["start"]),
+            len(journal["hashes"]),
+        )
+    )
+    hashes = [fasta_reader.sequence_hash(sequence) for name, sequence, end in records]
+
+    return hashes == journal["hashes"] and (
+        not records or records[-1][2] == journal["offset"]
+    )
+
+
+## function to load the journal of an interrupted run
+## a new journal is started if the last run finished or the fasta has changed since
+def resume(fasta_path, output_path):
+    try:
+        with open(journal_path(fasta_path, output_path), "r") as journal_file:
+            journal = json.load(journal_file)
+    except (OSError, ValueError):
+        return new_journal(fasta_path)
+
+    if journal["finished"] or not matches(journal, fasta_path):
+        return new_journal(fasta_path)
+
+    return journal
+
+
+## function to write the journal, the old journal is replaced in a single step
+## so there is always a valid journal, even if the program crashes while writing
+def save(journal, fasta_path, output_path):
+    path = journal_path(fasta_path, output_path)
+
+    with open(path + ".tmp", "w") as journal_file:
+        json.dump(journal, journal_file)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+
+    os.replace(path + ".tmp", path)
+
+
+## function to mark a batch as finished once its results are saved
+## names are the names of the batch as returned by fasta_reader.fasta_batches, end is the offset behind the batch
+## the journal is only written if durable is True, i.e. the results of the batch are on disk
+def advance(journal, fasta_path, output_path, names, end, rows, durable=True):
+    journal["start"], journal["offset"] = journal["offset"], end
+    journal["batches"] += 1
+    journal["records"] += len(names)
+    journal["rows"] += rows
+    journal["hashes"] = [seq_hash for name, seq_hash, keep in names]
+
+    if durable:
+        save(journal, fasta_path, output_path)
+
+
+## function to start the next run on this fasta from the beginning, even if the last one did not finish
+def reset(fasta_path, output_path):
+    try:
+        os.remove(journal_path(fasta_path, output_path))
+    except FileNotFoundError:
+        pass
+
+
+## function to add result pages that failed too often to the failed list
+## entries are dicts of name, hash and url, the list is written as one json object per line
+def add_failed(fasta_path, output_path, entries):
+    with open(failed_path(fasta_path, output_path), "a") as failed_file:
+        for entry in entries:
+            failed_file.write(json.dumps(entry) + "\n")
+        failed_file.flush()
+        os.fsync(failed_file.fileno())
+
+
+## function to read the failed list, every sequence is only returned once
+## batches that are repeated after a crash can list the same sequence twice
+def read_failed(fasta_path, output_path):
+    entries = {}
+
+    try:
+        with open(failed_path(fasta_path, output_path), "r") as failed_file:
+            for line in failed_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry["hash"]] = entry
+    except OSError:
+        pass
+
+    return list(entries.values())
+
+
+## function to remove the failed list, called when a run starts from the beginning
+def clear_failed(fasta_path, output_path):
+    try:
+        os.remove(failed_path(fasta_path, output_path))
+    except FileNotFoundError:
+        pass
+
+
+## function to save the result links of sequences as soon as BOLD returns them
+## links is a dict in form of {sequence hash: url}, saved as one json object per line
+def add_links(fasta_path, output_path, links):
+    with open(links_path(fasta_path, output_path), "a") as links_file:
+        for seq_hash, url in links.items():
+            links_file.write(json.dumps({"hash": seq_hash, "url": url}) + "\n")
+        links_file.flush()
+        os.fsync(links_file.fileno())
+
+
+## function to read the saved result links in form of {sequence hash: url}
+## the last line may be incomplete if the program crashed while writing
+def read_links(fasta_path, output_path):
+    links = {}
+
+    try:
+        with open(links_path(fasta_path, output_path), "r") as links_file:
+            for line in links_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                links[entry["hash"]] = entry["url"]
+    except OSError:
+        pass
+
+    return links
+
+
+## function to remove the saved links and pages of a run, they are only needed to resume it
+def clear_run(fasta_path, output_path):
+    for path in (
+        links_path(fasta_path, output_path),
+        pages_path(fasta_path, output_path),
+    ):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+## function to mark the run as finished, the next run on this fasta will start from the beginning
+def finish(journal, fasta_path, output_path):
+    journal["finished"] = True
+
+    save(journal, fasta_path, output_path)
+    clear_run(fasta_path, output_path)
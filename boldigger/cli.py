@@ -0,0 +1,370 @@
+import argparse, ast, datetime, getpass, json, os, pkgutil, sys
+from boldigger import (
+    batch_control,
+    http_pool,
+    id_cache,
+    login,
+    pipeline,
+    sharding,
+    markers,
+    results_store,
+    checkpoint,
+    metrics,
+    specimen_store,
+)
+
+
+## function to build the parser for all subcommands
+def parser():
+    parser = argparse.ArgumentParser(
+        prog="boldigger",
+        description="Query fasta files against the databases of boldsystems.org. "
+        "Run without arguments to start the graphical user interface.",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    identify_parser = subparsers.add_parser(
+        "identify", help="Run the BOLD identification engine without the GUI."
+    )
+    identify_parser.add_argument(
+        "--marker",
+        nargs="+",
+        choices=sorted(markers.MARKERS),
+        default=["coi"],
+        help="Markers to identify, several markers run at the same time.",
+    )
+    identify_parser.add_argument(
+        "--fasta", nargs="+", required=True, help="Fasta file to query per marker."
+    )
+    identify_parser.add_argument("--out", required=True, help="Output folder.")
+    identify_parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="Sequences per request, defaults to 50 (COI), 10 (ITS) or 5 (rbcL).",
+    )
+    identify_parser.add_argument(
+        "--username", help="BOLD username, defaults to $BOLDIGGER_USERNAME."
+    )
+    identify_parser.add_argument(
+        "--password", help="BOLD password, defaults to $BOLDIGGER_PASSWORD."
+    )
+    identify_parser.add_argument(
+        "--sessions",
+        type=int,
+        default=1,
+        help="Identify shards of the fasta with this many logins at once.",
+    )
+    identify_parser.add_argument(
+        "--credentials",
+        help="File with one username:password per line, one shard per account.",
+    )
+    identify_parser.add_argument(
+        "--keep-shards",
+        action="store_true",
+        help="Keep the shard folder with the results of every shard after the merge.",
+    )
+    identify_parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=http_pool.max_in_flight,
+        help="Maximum number of result pages downloaded at the same time.",
+    )
+    identify_parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=http_pool.rate_limit,
+        help="Maximum requests per second to BOLD, lowered automatically on 429.",
+    )
+    identify_parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=http_pool.max_attempts,
+        help="Attempts per result page before it is marked as failed.",
+    )
+    identify_parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Request the failed result pages again, the rest comes from the cache.",
+    )
+    identify_parser.add_argument(
+        "--results-backend",
+        choices=results_store.BACKENDS,
+        default=results_store.backend,
+        help="Format of the results while runtime, parquet requires pyarrow.",
+    )
+    identify_parser.add_argument(
+        "--write-buffer",
+        type=int,
+        default=results_store.buffer_size // 1024**2,
+        help="Megabytes of results that are collected before they are written.",
+    )
+    identify_parser.add_argument(
+        "--write-interval",
+        type=float,
+        default=results_store.flush_interval,
+        help="Seconds after which collected results are written in any case.",
+    )
+    identify_parser.add_argument(
+        "--no-cache", action="store_true", help="Do not use the identification cache."
+    )
+    identify_parser.add_argument(
+        "--cache-path",
+        default=id_cache.path,
+        help="Identification cache file, defaults to $BOLDIGGER_ID_CACHE.",
+    )
+    identify_parser.add_argument(
+        "--cache-days",
+        type=float,
+        default=id_cache.ttl / (24 * 60 * 60),
+        help="Days after which cached results are requested from BOLD again.",
+    )
+    identify_parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=id_cache.max_size // 1024**2,
+        help="Megabytes the identification cache may grow to.",
+    )
+    identify_parser.add_argument(
+        "--slow-post",
+        type=float,
+        default=batch_control.slow,
+        help="Seconds after which a slow answer of BOLD shrinks the batch size.",
+    )
+    identify_parser.add_argument(
+        "--fast-post",
+        type=float,
+        default=batch_control.fast,
+        help="Seconds below which fast answers of BOLD grow the batch size again.",
+    )
+    identify_parser.add_argument(
+        "--json", action="store_true", help="Print the progress as JSON lines."
+    )
+    identify_parser.add_argument(
+        "--metrics", help="Append timings and throughput of every batch to this file."
+    )
+    identify_parser.add_argument(
+        "--prometheus", help="Keep the totals of the run in this file for Prometheus."
+    )
+    identify_parser.set_defaults(func=identify)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest",
+        help="Load downloaded BOLD data packages into the local specimen store.",
+    )
+    ingest_parser.add_argument(
+        "package", nargs="+", help="Data package in tsv format, may be gzipped."
+    )
+    ingest_parser.add_argument(
+        "--store",
+        default=specimen_store.path,
+        help="Specimen store to ingest into, defaults to $BOLDIGGER_SPECIMEN_STORE.",
+    )
+    ingest_parser.add_argument(
+        "--json", action="store_true", help="Print the progress as JSON lines."
+    )
+    ingest_parser.set_defaults(func=ingest)
+
+    return parser
+
+
+## function to collect the userdata, saved userdata from the gui is used as last resort
+def credentials(args):
+    userdata = ast.literal_eval(pkgutil.get_data("boldigger", "data/userdata").decode())
+
+    username = (
+        args.username or os.environ.get("BOLDIGGER_USERNAME") or userdata["username"]
+    )
+    password = (
+        args.password or os.environ.get("BOLDIGGER_PASSWORD") or userdata["password"]
+    )
+
+    if not password and sys.stdin.isatty():
+        password = getpass.getpass("BOLD password: ")
+
+    return username, password
+
+
+## function to read a credentials file with one username:password per line
+## raises ValueError naming the first line that is not in this form or if there is no account
+def read_credentials(path):
+    accounts = []
+
+    with open(path, "r") as credentials_file:
+        for number, line in enumerate(credentials_file, 1):
+            if not line.strip():
+                continue
+            username, separator, password = line.strip().partition(":")
+            if not separator or not username:
+                raise ValueError(
+                    "Line {} of {} is not in the form username:password.".format(
+                        number, path
+                    )
+                )
+            accounts.append((username, password))
+
+    if not accounts:
+        raise ValueError("{} does not hold any account.".format(path))
+
+    return accounts
+
+
+## function to log in once per shard, either with every account of the credentials file
+## or several times with the same account
+## returns the list of sessions or None if any of the logins failed
+def login_sessions(args):
+    if args.credentials:
+        accounts = read_credentials(args.credentials)
+    else:
+        accounts = [credentials(args)] * args.sessions
+
+    sessions = [login.bold_login(username, password) for username, password in accounts]
+
+    return None if None in sessions else sessions
+
+
+## function to print one progress message, either human readable or as a JSON line
+def print_progress(kind, batch, message, finished, as_json):
+    now = datetime.datetime.now()
+
+    if as_json:
+        line = json.dumps(
+            {
+                "time": now.isoformat(timespec="seconds"),
+                "kind": kind,
+                "batch": None if batch is None else batch + 1,
+                "message": message,
+                "finished_records": finished,
+            }
+        )
+    else:
+        line = "{}: {}".format(
+            now.strftime("%H:%M:%S"), pipeline.describe(batch, message)
+        )
+
+    print(line, flush=True)
+
+
+## identify subcommand: log in and run the engine without importing the gui
+def identify(args):
+    if len(args.marker) != len(args.fasta):
+        print("Please give one fasta file per marker.", file=sys.stderr)
+        return 2
+    if len(args.marker) > 1 and (args.sessions > 1 or args.credentials):
+        print("Several markers can only be run with one session.", file=sys.stderr)
+        return 2
+
+    ## the retry runs the whole fasta again, all pages that did not fail come from the cache
+    if args.retry_failed:
+        if args.no_cache:
+            print("--retry-failed needs the identification cache.", file=sys.stderr)
+            return 2
+        if not any(checkpoint.read_failed(path, args.out) for path in args.fasta):
+            print("There are no failed result pages to retry.")
+            return 0
+        for fasta_path in args.fasta:
+            checkpoint.reset(fasta_path, args.out)
+
+    http_pool.configure(
+        args.max_in_flight, attempts=args.max_attempts, rate=args.rate_limit
+    )
+    results_store.configure(
+        args.results_backend, args.write_buffer * 1024**2, args.write_interval
+    )
+    metrics.configure(args.metrics, args.prometheus)
+    id_cache.configure(
+        args.cache_path, args.cache_days * 24 * 60 * 60, args.cache_size * 1024**2
+    )
+    batch_control.configure(args.slow_post, args.fast_post)
+
+    try:
+        sessions = login_sessions(args)
+    except (OSError, ValueError) as error:
+        print("Unable to read the credentials: {}".format(error), file=sys.stderr)
+        return 2
+    if sessions is None:
+        print("Unable to login. Please check your userdata.", file=sys.stderr)
+        return 1
+
+    jobs = [
+        (marker, fasta_path, args.batch_size or markers.MARKERS[marker]["batch_size"])
+        for marker, fasta_path in zip(args.marker, args.fasta)
+    ]
+
+    ## several markers run at the same time, more than one session splits the fasta into shards
+    if len(jobs) > 1:
+        progress = markers.identify_all(jobs, sessions[0], args.out, not args.no_cache)
+    elif len(sessions) > 1:
+        marker, fasta_path, batch_size = jobs[0]
+        progress = sharding.identify(
+            markers.engine(marker),
+            sessions,
+            fasta_path,
+            args.out,
+            batch_size,
+            not args.no_cache,
+            args.keep_shards,
+        )
+    else:
+        marker, fasta_path, batch_size = jobs[0]
+        progress = pipeline.identify(
+            markers.engine(marker),
+            sessions[0],
+            fasta_path,
+            args.out,
+            batch_size,
+            not args.no_cache,
+        )
+
+    for kind, batch, message, finished in progress:
+        print_progress(kind, batch, message, finished, args.json)
+
+    print_progress("done", None, "Done.", finished, args.json)
+    return 0
+
+
+## ingest subcommand: load data packages, so additional data and the api correction
+## can resolve their process ids without network traffic
+def ingest(args):
+    specimen_store.configure(args.store)
+    total = 0
+
+    for package_path in args.package:
+
+        def progress(records):
+            message = "{}: {} records ingested.".format(
+                os.path.basename(package_path), records
+            )
+            print_progress("log", None, message, total + records, args.json)
+
+        try:
+            total += specimen_store.ingest(package_path, progress)
+        except (OSError, ValueError) as error:
+            print(
+                "Unable to ingest {}: {}".format(package_path, error), file=sys.stderr
+            )
+            return 1
+
+    print_progress("done", None, "Done.", total, args.json)
+    return 0
+
+
+## entry point of the boldigger command, starts the gui if no subcommand is given
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if not argv:
+        from boldigger import __main__ as gui
+
+        return gui.main()
+
+    args = parser().parse_args(argv)
+    if args.command is None:
+        parser().print_help()
+        sys.exit(2)
+
+    sys.exit(args.func(args))
+
+
+## run only if called as a toplevel script
+if __name__ == "__main__":
+    main()
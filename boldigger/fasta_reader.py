@@ -0,0 +1,73 @@
+import hashlib, locale, collections
+
+
+## function to hash a sequence, byte identical sequences will end up with the same hash
+def sequence_hash(sequence):
+    return hashlib.sha1(sequence.strip().upper().encode()).hexdigest()
+
+
+## generator to read all records of a fasta file one by one, starting at a byte offset
+## works for every valid fasta, sequences may be wrapped over several lines
+## yields (name, sequence, end) where end is the byte offset right behind the record
+## lines are decoded with the encoding of the system like a file opened in text mode,
+## characters that cannot be decoded are replaced instead of stopping the run
+def read_records(fasta_path, start=0):
+    name, sequence, position = None, [], start
+    encoding = locale.getpreferredencoding(False)
+
+    with open(fasta_path, "rb") as input:
+        input.seek(start)
+        for line in iter(input.readline, b""):
+            line_start, position = position, position + len(line)
+            line = line.decode(encoding, errors="replace").strip()
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(sequence), line_start
+                name, sequence = line, []
+            elif line:
+                sequence.append(line)
+
+    if name is not None:
+        yield name, "".join(sequence), position
+
+
+## function to count the records of a fasta file, used for progress bars
+def count_records(fasta_path):
+    return sum(1 for record in read_records(fasta_path))
+
+
+## generator to read the fasta file you want to blast batch by batch, starting at a byte offset
+## yields (names, query, end) where query is a string of query_size unique sequences
+## and end is the byte offset of the first record behind the batch
+## every unique sequence is only submitted once, even if it occurs several times in the fasta
+## sequences that are found in the identification cache (cached returns their hashes) are not submitted at all
+## names are given as (name, sequence hash, keep) where keep marks if the result is needed again later
+## only the sequence hashes are held in memory, the records are read lazily
+## query_size can also be a function returning the current batch size, so batches can adapt while reading
+def fasta_batches(fasta_path, query_size, cached=None, start=0):
+    batch_size = query_size if callable(query_size) else lambda: query_size
+
+    ## count how often every sequence occurs to know when a result is needed for the last time
+    remaining = collections.Counter(
+        sequence_hash(sequence)
+        for name, sequence, end in read_records(fasta_path, start)
+    )
+    submitted = cached(set(remaining)) if cached else set()
+    batch, names = [], []
+
+    for name, sequence, end in read_records(fasta_path, start):
+        seq_hash = sequence_hash(sequence)
+        remaining[seq_hash] -= 1
+        names.append((name, seq_hash, remaining[seq_hash] > 0))
+
+        if seq_hash not in submitted:
+            submitted.add(seq_hash)
+            batch += [name, sequence]
+
+        if len(batch) >= batch_size() * 2:
+            yield names, "\n".join(batch), end
+            batch, names = [], []
+
+    ## the last batch may consist of duplicates only and is then not sent to BOLD at all
+    if names:
+        yield names, "\n".join(batch), end
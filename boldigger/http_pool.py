@@ -0,0 +1,272 @@
+import asyncio, os, random, threading, time, requests_html
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import partial
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from requests.packages.urllib3.util.retry import Retry
+
+## user agent that is sent with every request
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.82 Safari/537.36"
+
+## maximum number of requests that are allowed to be in flight at the same time
+max_in_flight = 20
+
+## number of times a result page is requested before it is given up
+max_attempts = 5
+
+## pause before the second attempt in seconds, it doubles with every attempt up to max_backoff
+backoff = 1
+max_backoff = 60
+
+## maximum number of requests per second that are sent to one host, shared by all stages
+## the rate is halved after every 429 answer and slowly grows back to this value afterwards
+rate_limit = float(os.environ.get("BOLDIGGER_RATE_LIMIT", 10))
+min_rate = 0.2
+
+## number of requests that may be sent at once after a pause, a small burst keeps the rate steady
+burst = 1
+
+## number of times a request answered with 429 is sent again by the session itself
+throttled_attempts = 5
+
+## server all requests are sent to instead of boldsystems.org, e.g. a local mock server for benchmarks
+## None sends the requests to boldsystems.org
+base_url = os.environ.get("BOLDIGGER_BASE_URL")
+
+## shared state of the pool, everything is created lazily on first use
+_session = None
+_loop = None
+_executor = None
+_semaphore = None
+_lock = threading.Lock()
+
+## token buckets of all hosts in form of {host: {"rate", "next", "blocked"}}
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+## function to change the number of requests in flight, the attempts per page, the rate limit
+## and the server to query, has to be called before the first request
+def configure(in_flight=None, base=None, attempts=None, rate=None):
+    global max_in_flight, base_url, max_attempts, rate_limit, _executor, _semaphore
+
+    with _lock:
+        max_in_flight = in_flight if in_flight is not None else max_in_flight
+        base_url = base if base is not None else base_url
+        max_attempts = attempts if attempts is not None else max_attempts
+        rate_limit = rate if rate is not None else rate_limit
+        _executor, _semaphore = None, None
+
+    with _buckets_lock:
+        _buckets.clear()
+
+
+## function to send a boldsystems.org url to the configured server instead
+def url(address):
+    if base_url is None:
+        return address
+
+    parts = urlsplit(address)
+    return "{}{}{}".format(
+        base_url.rstrip("/"), parts.path, "?" + parts.query if parts.query else ""
+    )
+
+
+## function to return the token bucket of the host of a url
+## www.boldsystems.org and boldsystems.org share one bucket
+def bucket(address):
+    host = urlsplit(address).netloc.lower()
+    host = host[4:] if host.startswith("www.") else host
+
+    with _buckets_lock:
+        return _buckets.setdefault(host, {"rate": rate_limit, "next": 0, "blocked": 0})
+
+
+## function to wait until the host of a url may receive the next request
+## every request reserves the next free slot, so waiting requests are sent in order
+## and the host never gets more than its rate, no matter how many threads are waiting
+def acquire(address):
+    host_bucket = bucket(address)
+
+    with _buckets_lock:
+        now = time.monotonic()
+        slot = max(
+            host_bucket["next"],
+            host_bucket["blocked"],
+            now - (burst - 1) / host_bucket["rate"],
+        )
+        host_bucket["next"] = slot + 1 / host_bucket["rate"]
+
+    time.sleep(max(0, slot - now))
+
+
+## function to return the seconds a 429 answer asks to wait, None if it does not say
+def retry_after(response):
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+## function to slow down a host that answered with 429
+## no request is sent to the host before the pause it asked for is over
+def throttled(address, pause=None):
+    host_bucket = bucket(address)
+
+    with _buckets_lock:
+        host_bucket["rate"] = max(min_rate, host_bucket["rate"] / 2)
+        pause = pause if pause is not None else 1 / host_bucket["rate"]
+        host_bucket["blocked"] = max(host_bucket["blocked"], time.monotonic() + pause)
+
+
+## function to let the rate of a host grow back to the limit after it was throttled
+def relieved(address):
+    host_bucket = bucket(address)
+
+    with _buckets_lock:
+        host_bucket["rate"] = min(rate_limit, host_bucket["rate"] + rate_limit / 100)
+
+
+## transport adapter that paces every request of a session with the token bucket of its host
+## 429 answers slow the host down and are sent again once the host allows it
+class RateLimitedAdapter(HTTPAdapter):
+    def send(self, request, **kwargs):
+        for attempt in range(throttled_attempts):
+            acquire(request.url)
+            response = super().send(request, **kwargs)
+
+            if response.status_code != 429:
+                relieved(request.url)
+                return response
+
+            throttled(request.url, retry_after(response))
+            if attempt < throttled_attempts - 1:
+                response.close()
+
+        return response
+
+
+## function to create a new html session with keep-alive connections for all workers
+## all requests of the session are paced by the rate limit of their host
+def new_session():
+    session = requests_html.HTMLSession()
+    session.headers.update({"User-Agent": USER_AGENT})
+
+    ## only connections that could not be opened are retried by the session, those never reach
+    ## the host, error answers are retried by the callers, so every attempt passes the rate limiter
+    retry_strategy = Retry(connect=3, read=0, status=0, backoff_factor=1)
+
+    ## keep one connection per worker alive, plus one for the long running post requests
+    adapter = RateLimitedAdapter(
+        max_retries=retry_strategy,
+        pool_connections=4,
+        pool_maxsize=max_in_flight + 1,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+## function to return the shared session, a fresh one is created if nobody logged in yet
+def get_session():
+    global _session
+
+    with _lock:
+        if _session is None:
+            _session = new_session()
+        return _session
+
+
+## function to share a session (e.g. the logged in one) with all other stages
+def set_session(session):
+    global _session
+
+    with _lock:
+        _session = session
+
+
+## function to return the event loop all downloads are running in
+## the loop lives in its own thread, so it can be used from every stage
+def event_loop():
+    global _loop
+
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+        return _loop
+
+
+## function to run a coroutine in the shared event loop and wait for the result
+def run(coroutine):
+    return submit(coroutine).result()
+
+
+## function to start a coroutine in the shared event loop without waiting for it
+## returns a concurrent.futures.Future, so the caller can follow the coroutines as they finish
+def submit(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop())
+
+
+## function to send a get request outside the event loop until it is answered without an error
+## failed requests are sent again after backoff_delay, raises the last error after max_attempts
+def get_with_retries(session, url, **kwargs):
+    for attempt in range(max_attempts):
+        if attempt:
+            time.sleep(backoff_delay(attempt))
+        try:
+            response = session.get(url, **kwargs)
+            response.raise_for_status()
+            return response
+        except RequestException as error:
+            last_error = error
+
+    raise last_error
+
+
+## function to return the executor and the semaphore limiting the requests in flight
+## only called from inside the event loop, so no lock is needed for the semaphore
+def _limits():
+    global _executor, _semaphore
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max_in_flight)
+
+    return _executor, _semaphore
+
+
+## function to return the pause before the next attempt of a request in seconds
+## attempt is the number of failed attempts, the pause is drawn at random up to an exponentially
+## growing limit, so retries of many pages that failed at the same time do not hit the server
+## at the same time again
+def backoff_delay(attempt):
+    return random.uniform(0, min(max_backoff, backoff * 2 ** (attempt - 1)))
+
+
+## asynchronous pause before the next attempt of a request, see backoff_delay
+async def wait_backoff(attempt):
+    await asyncio.sleep(backoff_delay(attempt))
+
+
+## asynchronous get request, waits until a slot is free before it is sent
+async def get(url, session=None, **kwargs):
+    session = session or get_session()
+    executor, semaphore = _limits()
+
+    async with semaphore:
+        return await asyncio.get_event_loop().run_in_executor(
+            executor, partial(session.get, url, **kwargs)
+        )
@@ -0,0 +1,115 @@
+import os, json, time
+import pandas as pd
+from boldigger import sqlite_cache
+
+## location of the identification cache, the age in seconds after which a result is requested
+## from BOLD again (90 days) and the size in bytes above which the oldest results are dropped (1 GB)
+## set with BOLDIGGER_ID_CACHE, BOLDIGGER_ID_CACHE_DAYS and BOLDIGGER_ID_CACHE_MB
+path, ttl, max_size = sqlite_cache.settings(
+    "BOLDIGGER_ID_CACHE", "identification_cache.sqlite", 90, 1024
+)
+
+
+## function to change location, age and size of the identification cache for the command line
+## has to be called before a run is started
+def configure(cache_path=None, max_age=None, size=None):
+    global path, ttl, max_size
+
+    path = cache_path if cache_path is not None else path
+    ttl = max_age if max_age is not None else ttl
+    max_size = size if size is not None else max_size
+
+
+## function to open the identification cache, the results table is created on first use
+## cache_path opens another database with the same layout, e.g. the pages of a single run
+def open_cache(cache_path=None):
+    return sqlite_cache.open_database(
+        cache_path or path,
+        [
+            "CREATE TABLE IF NOT EXISTS results (searchdb TEXT, tabtype TEXT, "
+            "hash TEXT, created REAL, size INTEGER, data BLOB, "
+            "PRIMARY KEY (searchdb, tabtype, hash))",
+            "CREATE INDEX IF NOT EXISTS results_created ON results (created)",
+        ],
+    )
+
+
+## generator to query the cache for many hashes at once
+## only results that were stored after created are returned
+## tables are saved as json text, binary tables pickled by older versions count as missing
+def select(connection, columns, searchdb, tabtype, hashes, created):
+    return sqlite_cache.select(
+        connection,
+        "SELECT " + columns + " FROM results WHERE searchdb = ? AND tabtype = ? "
+        "AND created > ? AND typeof(data) = 'text' AND hash IN ({})",
+        [searchdb, tabtype, created],
+        hashes,
+    )
+
+
+## function to return the hashes that have a valid result in the cache
+def cached(connection, searchdb, tabtype, hashes):
+    return {
+        row[0]
+        for row in select(
+            connection, "hash", searchdb, tabtype, hashes, time.time() - ttl
+        )
+    }
+
+
+## function to convert a result table to json, independent of the pandas version
+def encode(table):
+    return json.dumps(
+        {"columns": list(table.columns), "data": table.to_numpy().tolist()}
+    )
+
+
+## function to convert json back to a result table, raises ValueError if the data is damaged
+def decode(data):
+    try:
+        table = json.loads(data)
+        return pd.DataFrame(table["data"], columns=table["columns"])
+    except (KeyError, TypeError) as error:
+        raise ValueError("Damaged cache entry: {}".format(error))
+
+
+## function to load the cached result tables of the given hashes
+## results are not checked for their age again, they were valid when the batches were built
+## damaged entries are removed and left out, so they are requested again by the next run
+## returns a dict in form of {hash: table}
+def load(connection, searchdb, tabtype, hashes):
+    tables, damaged = {}, []
+
+    for seq_hash, data in select(
+        connection, "hash, data", searchdb, tabtype, hashes, 0
+    ):
+        try:
+            tables[seq_hash] = decode(data)
+        except ValueError:
+            damaged.append((searchdb, tabtype, seq_hash))
+
+    if damaged:
+        with sqlite_cache.lock, connection:
+            connection.executemany(
+                "DELETE FROM results WHERE searchdb = ? AND tabtype = ? AND hash = ?",
+                damaged,
+            )
+
+    return tables
+
+
+## function to store the result tables of a batch, tables is a dict in form of {hash: table}
+def store(connection, searchdb, tabtype, tables):
+    now = time.time()
+    rows = []
+
+    for seq_hash, table in tables.items():
+        data = encode(table)
+        rows.append((searchdb, tabtype, seq_hash, now, len(data), data))
+
+    sqlite_cache.insert(connection, "results", rows)
+
+
+## function to remove expired results and the oldest results if the cache grows too big
+def evict(connection):
+    sqlite_cache.evict(connection, "results", ttl, max_size)
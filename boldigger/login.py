@@ -1,27 +1,13 @@
-import requests_html, json, os
-import PySimpleGUI as sg
+import json, os
 from bs4 import BeautifulSoup as BSoup
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from boldigger import http_pool
 
 
-## function to login to bold
-def login(username, password, remember=False):
-    ## start a new html session
-    session = requests_html.HTMLSession()
-    session.headers.update(
-        {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.82 Safari/537.36"
-        }
-    )
-    retry_strategy = Retry(
-        total=15,
-        status_forcelist=[400, 401, 403, 404, 413, 429, 500, 502, 503, 504],
-        backoff_factor=1,
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
+## function to login to bold without any user interaction
+## returns the logged in session or None if the login failed
+def bold_login(username, password):
+    ## start a new html session from the shared pool
+    session = http_pool.new_session()
 
     ## data to push into the post request
     data = {
@@ -32,14 +18,30 @@ def login(username, password, remember=False):
     }
 
     ## send a post request to log into boldsystems.org
-    session.post("https://boldsystems.org/index.php/Login", data=data)
+    session.post(http_pool.url("https://boldsystems.org/index.php/Login"), data=data)
 
     ## test if the login was successfull
-    url = session.get("https://boldsystems.org/")
+    url = session.get(http_pool.url("https://boldsystems.org/"))
     soup = BSoup(url.text, "html.parser")
     content = soup.find(class_="site-navigation nav navbar-nav")
     tags = content.find_all("a")
     if tags[5].text != "Log out":
+        return None
+
+    ## share the logged in session and its cookies with all other stages
+    http_pool.set_session(session)
+
+    return session
+
+
+## function to login to bold from the gui
+def login(username, password, remember=False):
+    ## the gui is only imported here, so the login can also run headless
+    import PySimpleGUI as sg
+
+    session = bold_login(username, password)
+
+    if session is None:
         sg.popup("Unable to login.\nPlease check your userdata.")
     else:
         sg.popup("Login successful.")
@@ -0,0 +1,335 @@
+import openpyxl, ntpath, os, datetime, asyncio, types, time
+import numpy as np
+import pandas as pd
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from functools import partial
+from bs4 import BeautifulSoup as BSoup
+from requests.exceptions import RequestException
+from boldigger import pipeline, http_pool, result_parser, results_store, metrics
+
+## columns of the result tables
+COI_COLUMNS = [
+    "Phylum",
+    "Class",
+    "Order",
+    "Family",
+    "Genus",
+    "Species",
+    "Subspecies",
+    "Similarity",
+    "Status",
+]
+BLAST_COLUMNS = [
+    "Rank",
+    "Phylum",
+    "Class",
+    "Order",
+    "Family",
+    "Genus",
+    "Species",
+    "Subspecies",
+    "Score",
+    "Similarity",
+    "E_Value",
+    "Status",
+]
+
+## numeric columns of the blast results, all other columns hold text
+BLAST_CONVERTERS = {
+    "Rank": int,
+    "Score": float,
+    "Similarity": float,
+    "E_Value": float,
+}
+
+## everything that differs between the markers, the identification engine is the same for all of them
+## searchdb and tabtype select the database and are also used as key for the identification cache
+## fill are the text columns that are filled with empty strings to be compatible with the hdf format
+## numeric columns keep nan for empty cells, a mix of strings and numbers cannot be saved
+## excel_parts numbers every excel file, otherwise only the files after the first one are numbered
+## batch_size is the recommended number of sequences per request
+MARKERS = {
+    "coi": {
+        "label": "COI",
+        "searchdb": "COX1",
+        "tabtype": "animalTabPane",
+        "url": "https://boldsystems.org/index.php/IDS_IdentificationRequest",
+        "form": {"historicalDB": ""},
+        "columns": COI_COLUMNS,
+        "converters": {"Similarity": float},
+        "no_match": ["No Match"] * 7 + [np.nan] + [""] * 2,
+        "fill": [column for column in COI_COLUMNS if column != "Similarity"],
+        "excel_columns": [
+            "You searched for",
+            "Phylum",
+            "Class",
+            "Order",
+            "Family",
+            "Genus",
+            "Species",
+            "Subspecies",
+            "Similarity",
+            "Status",
+            "Process ID",
+        ],
+        "excel_parts": True,
+        "batch_size": 50,
+    },
+    "its": {
+        "label": "ITS",
+        "searchdb": "ITS",
+        "tabtype": "fungiTabPane",
+        "url": "http://boldsystems.org/index.php/IDS_BlastRequest",
+        "form": {},
+        "columns": BLAST_COLUMNS,
+        "converters": BLAST_CONVERTERS,
+        "no_match": [0] + ["No Match"] * 7 + [np.nan] * 3 + [""] * 2,
+        "fill": [column for column in BLAST_COLUMNS if column not in BLAST_CONVERTERS],
+        "excel_columns": [
+            "You searched for",
+            "Rank",
+            "Phylum",
+            "Class",
+            "Order",
+            "Family",
+            "Genus",
+            "Species",
+            "Subspecies",
+            "Score",
+            "Similarity",
+            "E-Value",
+            "Status",
+            "Process ID",
+        ],
+        "excel_parts": False,
+        "batch_size": 10,
+    },
+}
+MARKERS["rbcl"] = dict(
+    MARKERS["its"],
+    label="rbcL & matK",
+    searchdb="MATK_RBCL",
+    tabtype="plantTabPane",
+    batch_size=5,
+)
+
+## number of rows after which the excel output continues in a new part
+## leaves enough space to the row limit of excel to finish the hits of the last sequence
+EXCEL_ROWS = 1000000
+
+## function to generate a link for every query
+def post_request(marker, query, session):
+    seq_data = dict(
+        marker["form"],
+        tabtype=marker["tabtype"],
+        searchdb=marker["searchdb"],
+        sequence=query,
+    )
+
+    ## send search request
+    r = session.post(http_pool.url(marker["url"]), data=seq_data, timeout=900)
+
+    ## too large or failed requests are answered with an error status
+    r.raise_for_status()
+
+    ## extract Top20 table links from the BOLD Result page
+    soup = BSoup(r.text, "html5lib")
+    data = soup.find_all("span", style="text-decoration: none")
+    data = [
+        http_pool.url("http://boldsystems.org" + data[i].get("result"))
+        for i in range(len(data))
+    ]
+
+    ## return the data
+    return data
+
+
+## function to return the table of a result page without a match
+def no_match_table(marker):
+    return pd.DataFrame(
+        [marker["no_match"]] * 20, columns=marker["columns"] + ["Process_ID"]
+    )
+
+
+## function to return the table saved for a result page that could not be downloaded
+## it looks like a page without a match, the status marks it as failed
+def failed_table(marker):
+    table = no_match_table(marker)
+    table["Status"] = "Failed"
+
+    return table
+
+
+## asynchronous request code to send all requests at once
+## failed downloads and malformed pages are requested again after a growing, jittered pause
+## returns None if the page still fails after http_pool.max_attempts attempts
+## latency, size and parse time of the page are added to the metrics record of its batch
+async def as_request(marker, url, session, record=None):
+    for attempt in range(http_pool.max_attempts):
+        if attempt:
+            metrics.add(record, "page_retries")
+            await http_pool.wait_backoff(attempt)
+        try:
+            start = time.perf_counter()
+            r = await http_pool.get(url, session, timeout=300)
+            metrics.observe(record, "page_seconds", time.perf_counter() - start)
+            metrics.add(record, "bytes_downloaded", len(r.content))
+            r.raise_for_status()
+
+            start = time.perf_counter()
+            table = result_parser.parse_page(
+                r.text, marker["columns"], marker["converters"]
+            )
+            metrics.add(record, "parse_seconds", time.perf_counter() - start)
+            break
+        except (ValueError, RequestException):
+            continue
+    else:
+        metrics.add(record, "failed_pages")
+        return None
+
+    ## return No Match if there is no result table
+    if table is None:
+        table = no_match_table(marker)
+
+    ## return result if there is one, the process ids are already added by the parser
+    else:
+        table[marker["fill"]] = table[marker["fill"]].fillna("")
+
+    return table
+
+
+## gather all tasks for the event loop, all of them share the same session
+## the number of requests in flight is limited by the http pool
+## record is the metrics record of the batch the pages belong to
+## sequences that BOLD refused have no link, None is returned for their page
+async def as_session(marker, url_list, session=None, record=None):
+    async def request(url):
+        if url is None:
+            return None
+        return await as_request(marker, url, session, record)
+
+    return await asyncio.gather(*(request(url) for url in url_list))
+
+
+## function to concat the returned dataframes
+## tables holds the results of this batch in form of {sequence hash: table}, they are fanned out
+## to every sequence name again so the output keeps the order of the fasta
+## known_tables holds the results of duplicates that are needed again in a later batch
+def save_as_df(tables, sequence_names, known_tables):
+    results = []
+
+    for name, seq_hash, keep in sequence_names:
+        ## results of new sequences come from the tables of this batch
+        if seq_hash not in known_tables:
+            known_tables[seq_hash] = tables[seq_hash]
+
+        ## drop the table as soon as it is not needed anymore
+        table = known_tables[seq_hash] if keep else known_tables.pop(seq_hash)
+
+        ## add sequence names to the results
+        table = table.copy()
+        table.insert(0, "You_searched_for", [name] + [np.nan] * (len(table) - 1))
+        results.append(table)
+
+    ## concat the resulting tables from the requested resultpages
+    return pd.concat(results, axis=0)
+
+
+## function to return the path of an excel part
+## markers without parts keep the old name for the first file
+def excel_path(marker, fasta_path, output_path, part):
+    name = ntpath.splitext(ntpath.basename(fasta_path))[0]
+
+    if part == 1 and not marker["excel_parts"]:
+        return os.path.join(output_path, "BOLDResults_{}.xlsx".format(name))
+    return os.path.join(output_path, "BOLDResults_{}_part_{}.xlsx".format(name, part))
+
+
+## function to open a new excel part in write only mode, rows are streamed to disk
+## instead of building the whole workbook in memory
+def new_part(marker, sheet_name):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+
+    header = []
+    for column in marker["excel_columns"]:
+        cell = WriteOnlyCell(sheet, value=column)
+        cell.font = Font(bold=True)
+        header.append(cell)
+    sheet.append(header)
+
+    return workbook, sheet
+
+
+## function to convert downloaded h5 data to excel in the end
+## the results are read in chunks and streamed into the workbook, so memory stays constant
+## a new part is started at the first sequence after EXCEL_ROWS rows, so the hits of a sequence
+## are never split over two files
+def excel_converter(marker, fasta_path, output_path, chunksize=50000):
+    sheet_name = "Run {}".format(datetime.datetime.now().strftime("%d-%m-%Y %H.%M"))
+    savename = partial(excel_path, marker, fasta_path, output_path)
+    part, rows = 1, 0
+    workbook, sheet = new_part(marker, sheet_name)
+
+    for chunk in results_store.chunks(fasta_path, output_path, chunksize=chunksize):
+        ## empty cells are written as None, the first column only holds a name on the first hit
+        starts = chunk["You_searched_for"].notna().to_numpy()
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+
+        for start, row in zip(starts, chunk.itertuples(index=False, name=None)):
+            if start and rows >= EXCEL_ROWS:
+                workbook.save(savename(part))
+                part, rows = part + 1, 0
+                workbook, sheet = new_part(marker, sheet_name)
+            sheet.append(row)
+            rows += 1
+
+    workbook.save(savename(part))
+
+
+## function to return the identification engine of a marker, as used by the pipeline
+def engine(name):
+    marker = MARKERS[name]
+
+    return types.SimpleNamespace(
+        NAME=name,
+        SEARCHDB=marker["searchdb"],
+        TABTYPE=marker["tabtype"],
+        post_request=partial(post_request, marker),
+        as_session=partial(as_session, marker),
+        save_as_df=save_as_df,
+        failed_table=partial(failed_table, marker),
+        save_results=partial(results_store.append, marker),
+        flush_results=results_store.flush,
+        finalize_results=results_store.finalize,
+        truncate_results=results_store.truncate,
+        count_results=results_store.count,
+        results_location=results_store.location,
+        excel_converter=partial(excel_converter, marker),
+    )
+
+
+## function to run several marker jobs at the same time on the shared event loop and connection pool
+## jobs is a list of (marker name, fasta path, batch size)
+## yields the same progress tuples as pipeline.identify, the messages name their marker
+def identify_all(jobs, session, output_path, use_cache=True):
+    ## every job needs its own result file and journal
+    savenames = [
+        results_store.path(fasta_path, output_path) for name, fasta_path, size in jobs
+    ]
+    if len(set(savenames)) < len(savenames):
+        raise ValueError("Every marker job needs a fasta file with a different name.")
+
+    yield from pipeline.concurrent(
+        [
+            (
+                MARKERS[name]["label"],
+                pipeline.identify(
+                    engine(name), session, fasta_path, output_path, size, use_cache
+                ),
+            )
+            for name, fasta_path, size in jobs
+        ]
+    )
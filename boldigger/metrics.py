@@ -0,0 +1,199 @@
+import os, json, ntpath, threading, time
+
+## file every finished batch is appended to as a json line, None disables the json metrics
+path = os.environ.get("BOLDIGGER_METRICS")
+
+## file the totals of all runs are written to in the prometheus text format after every batch
+## e.g. for the textfile collector of the node exporter, None disables it
+prometheus_path = os.environ.get("BOLDIGGER_PROMETHEUS")
+
+## quantiles of the result page latencies that are reported
+QUANTILES = [0.5, 0.9, 0.99]
+
+## values of a batch that are summed up over the whole run, in form of (key, help text)
+COUNTERS = [
+    ("sequences", "Identified sequences."),
+    ("pages", "Downloaded result pages."),
+    ("failed_pages", "Result pages that were given up."),
+    ("post_retries", "Posts to BOLD that were repeated."),
+    ("page_retries", "Result page downloads that were repeated."),
+    ("bytes_downloaded", "Bytes of downloaded result pages."),
+    ("post_seconds", "Seconds spent posting sequences."),
+    ("fetch_seconds", "Seconds spent downloading result pages."),
+    ("parse_seconds", "Seconds spent parsing result pages."),
+    ("write_seconds", "Seconds spent saving results."),
+]
+
+## totals of every fasta in form of {(marker, fasta): {...}}
+## records and totals are updated from several threads
+_totals = {}
+_lock = threading.Lock()
+
+
+## function to change the metric files, has to be called before a run is started
+def configure(json_path=None, prometheus=None):
+    global path, prometheus_path
+
+    path = json_path if json_path is not None else path
+    prometheus_path = prometheus if prometheus is not None else prometheus_path
+
+
+## function to start the record of a batch, it is handed from stage to stage with the batch
+## returns None if no metrics are written, all other functions accept None and do nothing
+def new_record(marker, fasta_path, batch):
+    if path is None and prometheus_path is None:
+        return None
+
+    return {
+        "marker": marker,
+        "fasta": ntpath.splitext(ntpath.basename(fasta_path))[0],
+        "batch": batch + 1,
+        "started": time.monotonic(),
+        "post_seconds": 0.0,
+        "post_retries": 0,
+        "page_seconds": [],
+        "page_retries": 0,
+        "failed_pages": 0,
+        "parse_seconds": 0.0,
+        "write_seconds": 0.0,
+        "bytes_downloaded": 0,
+    }
+
+
+## function to add a value to a counter of a record
+def add(record, key, value=1):
+    if record is not None:
+        with _lock:
+            record[key] += value
+
+
+## function to add a single measurement, e.g. the latency of one result page
+def observe(record, key, value):
+    if record is not None:
+        with _lock:
+            record[key].append(value)
+
+
+## function to return a quantile of a list of values, None for an empty list
+def quantile(values, q):
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+## function to close the record of a saved batch and write it to the metric files
+## sequences is the number of fasta records of the batch, including duplicates
+def finish(record, sequences):
+    if record is None:
+        return
+
+    with _lock:
+        seconds = time.monotonic() - record["started"]
+        pages = record["page_seconds"]
+        line = {
+            key: value
+            for key, value in record.items()
+            if key not in ("started", "page_seconds")
+        }
+        line.update(
+            time=time.time(),
+            sequences=sequences,
+            seconds=round(seconds, 3),
+            sequences_per_second=round(sequences / seconds, 3) if seconds else None,
+            pages=len(pages),
+            fetch_seconds=round(sum(pages), 3),
+            page_seconds={
+                "p{}".format(int(q * 100)): quantile(pages, q) for q in QUANTILES
+            },
+        )
+
+        if path is not None:
+            with open(path, "a") as metrics_file:
+                metrics_file.write(json.dumps(line) + "\n")
+
+        totals = _totals.setdefault(
+            (record["marker"], record["fasta"]),
+            dict(
+                {key: 0 for key, description in COUNTERS},
+                started=record["started"],
+                batches=0,
+            ),
+        )
+        for key, description in COUNTERS:
+            totals[key] += line[key]
+        totals["batches"] += 1
+        totals["last_batch"] = line["time"]
+        totals["page_quantiles"] = {q: quantile(pages, q) for q in QUANTILES}
+
+        if prometheus_path is not None:
+            write_prometheus()
+
+
+## function to format one metric in the prometheus text format
+## samples is a list of (labels, value) where labels is a dict
+def prometheus_metric(name, kind, description, samples):
+    lines = [
+        "# HELP boldigger_{} {}".format(name, description),
+        "# TYPE boldigger_{} {}".format(name, kind),
+    ]
+    for labels, value in samples:
+        labels = ",".join('{}="{}"'.format(*label) for label in labels.items())
+        lines.append("boldigger_{}{{{}}} {}".format(name, labels, value))
+
+    return lines
+
+
+## function to write the totals of all runs in the prometheus text format
+## the old file is replaced in a single step, so a scrape never sees half a file
+def write_prometheus():
+    runs = [
+        ({"marker": marker, "fasta": fasta}, totals)
+        for (marker, fasta), totals in sorted(_totals.items())
+    ]
+    now = time.monotonic()
+
+    lines = prometheus_metric(
+        "batches_total",
+        "counter",
+        "Saved batches.",
+        [(labels, totals["batches"]) for labels, totals in runs],
+    )
+    for key, description in COUNTERS:
+        lines += prometheus_metric(
+            key + "_total",
+            "counter",
+            description,
+            [(labels, totals[key]) for labels, totals in runs],
+        )
+    lines += prometheus_metric(
+        "last_batch_timestamp_seconds",
+        "gauge",
+        "Unix time the last batch was saved.",
+        [(labels, totals["last_batch"]) for labels, totals in runs],
+    )
+    lines += prometheus_metric(
+        "sequences_per_second",
+        "gauge",
+        "Sequences per second since the run started.",
+        [
+            (labels, totals["sequences"] / max(now - totals["started"], 1e-9))
+            for labels, totals in runs
+        ],
+    )
+    lines += prometheus_metric(
+        "page_seconds",
+        "gauge",
+        "Result page latency in the last batch.",
+        [
+            (dict(labels, quantile=q), value)
+            for labels, totals in runs
+            for q, value in totals["page_quantiles"].items()
+            if value is not None
+        ],
+    )
+
+    with open(prometheus_path + ".tmp", "w") as prometheus_file:
+        prometheus_file.write("\n".join(lines) + "\n")
+    os.replace(prometheus_path + ".tmp", prometheus_path)
@@ -0,0 +1,625 @@
+import queue, threading, time
+from functools import partial
+from boldigger import (
+    http_pool,
+    id_cache,
+    fasta_reader,
+    checkpoint,
+    batch_control,
+    metrics,
+)
+from requests.exceptions import RequestException
+
+## marker that is passed down the queues once a stage has no more work
+STOP = None
+
+
+## function to put an item into a queue, gives up if the pipeline is aborted
+def put(work_queue, item, abort):
+    while not abort.is_set():
+        try:
+            work_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+## function to get an item from a queue, returns STOP if the pipeline is aborted
+def get(work_queue, abort):
+    while not abort.is_set():
+        try:
+            return work_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return STOP
+
+
+## function to report the progress of a stage to the controlling thread
+## records is the number of fasta records that were finished with this message
+def report(status, kind, batch, message, records=0):
+    status.put((kind, batch, message, records))
+
+
+## function to tell the user about a new batch size
+def report_size(status, batch, controller):
+    report(
+        status,
+        "log",
+        batch,
+        "Batch size changed to {}.".format(batch_control.size(controller)),
+    )
+
+
+## function to post a query to BOLD until it answers with the result links
+## if BOLD fails to answer, the query is split in half and both halves are posted on their own
+## a single sequence is posted again after a pause and given up after http_pool.max_attempts
+## attempts, its link is None then and its page is saved as failed
+## the controller adapts the size of the following batches to the latency and errors of BOLD
+## returns None if the pipeline has been aborted in the meantime
+## latency and retries are added to the metrics record of the batch
+def request_links(
+    engine, query, session, batch, status, abort, controller, record=None
+):
+    lines = query.split("\n")
+    sequences = len(lines) // 2
+    attempt = 0
+
+    while not abort.is_set():
+        try:
+            report(status, "log", batch, "Requesting BOLD. This will take a while.")
+            start = time.monotonic()
+            links = engine.post_request(query, session)
+            metrics.add(record, "post_seconds", time.monotonic() - start)
+
+            ## BOLD answers with one result link per sequence, anything else is an error page
+            if len(links) != sequences:
+                raise ValueError(
+                    "Received {} result links for {} sequences.".format(
+                        len(links), sequences
+                    )
+                )
+        except (ValueError, RequestException):
+            if batch_control.failed(controller, sequences):
+                report_size(status, batch, controller)
+
+            ## a single sequence cannot be split any further, so it is posted again
+            if sequences == 1:
+                attempt += 1
+                if attempt >= http_pool.max_attempts:
+                    report(status, "log", batch, "BOLD refused a sequence! Giving up.")
+                    return [None]
+                metrics.add(record, "post_retries")
+                report(status, "log", batch, "BOLD did not respond! Retrying.")
+                abort.wait(http_pool.backoff_delay(attempt))
+                continue
+
+            metrics.add(record, "post_retries")
+            report(status, "log", batch, "BOLD did not respond! Splitting the batch.")
+            half = sequences // 2 * 2
+            links = [
+                request_links(
+                    engine,
+                    "\n".join(part),
+                    session,
+                    batch,
+                    status,
+                    abort,
+                    controller,
+                    record,
+                )
+                for part in (lines[:half], lines[half:])
+            ]
+            return None if None in links else links[0] + links[1]
+
+        if batch_control.succeeded(controller, sequences, time.monotonic() - start):
+            report_size(status, batch, controller)
+        return links
+    return None
+
+
+## function to build a query of the sequences at the given positions of a query
+def subquery(lines, positions):
+    return "\n".join(
+        line
+        for position in positions
+        for line in lines[2 * position : 2 * position + 2]
+    )
+
+
+## function to post the sequences at the given positions of a query and save their links
+## so an interrupted run can download the pages without posting the sequences again
+## sequences that BOLD refused have no link, they are posted again by the next run
+## returns None if the pipeline has been aborted in the meantime
+def post_sequences(
+    engine,
+    lines,
+    positions,
+    session,
+    batch,
+    status,
+    abort,
+    controller,
+    fasta_path,
+    output_path,
+    record,
+):
+    query = subquery(lines, positions)
+    links = request_links(
+        engine, query, session, batch, status, abort, controller, record
+    )
+
+    if links is not None:
+        hashes = [fasta_reader.sequence_hash(seq) for seq in query.split("\n")[1::2]]
+        checkpoint.add_links(
+            fasta_path,
+            output_path,
+            {seq_hash: link for seq_hash, link in zip(hashes, links) if link},
+        )
+
+    return links
+
+
+## first stage: read the fasta lazily and submit one batch after another to the identification engine
+## sequences that already got a result link in an interrupted run (saved_links) are not posted again
+def post_stage(
+    engine,
+    session,
+    controller,
+    batches,
+    first,
+    saved_links,
+    fasta_path,
+    output_path,
+    links_queue,
+    status,
+    abort,
+):
+    for batch, (names, query, end) in enumerate(batches, first):
+        record = metrics.new_record(engine.NAME, fasta_path, batch)
+        lines = query.split("\n") if query else []
+        hashes = [fasta_reader.sequence_hash(seq) for seq in lines[1::2]]
+        links = [saved_links.pop(seq_hash, None) for seq_hash in hashes]
+        reused = [position for position, link in enumerate(links) if link]
+        missing = [position for position, link in enumerate(links) if not link]
+
+        ## batches of duplicates only do not have to be sent to BOLD
+        if missing:
+            posted = post_sequences(
+                engine,
+                lines,
+                missing,
+                session,
+                batch,
+                status,
+                abort,
+                controller,
+                fasta_path,
+                output_path,
+                record,
+            )
+            if posted is None:
+                return
+            for position, link in zip(missing, posted):
+                links[position] = link
+
+        report(status, "posted", batch, "Received result links.")
+        item = (batch, names, query, end, links, reused, record)
+        if not put(links_queue, item, abort):
+            return
+    put(links_queue, STOP, abort)
+
+
+## function to save the downloaded pages of a batch in the cache in a single transaction
+## hashes are the sequence hashes in the order of the tables, failed pages are not saved
+def store_pages(engine, cache, hashes, tables):
+    id_cache.store(
+        cache,
+        engine.SEARCHDB,
+        engine.TABTYPE,
+        {
+            seq_hash: table
+            for seq_hash, table in zip(hashes, tables)
+            if table is not None
+        },
+    )
+
+
+## second stage: download and parse all result pages of a batch
+## the pages are saved in the cache once the batch is downloaded, so an interrupted run
+## does not download the pages of finished batches again
+## links saved by an interrupted run may have expired, only their sequences are posted again
+## every page is retried on its own, pages that still fail are saved as failed and added to
+## the failed list of the fasta, so a later run can request them again
+def download_stage(
+    engine,
+    session,
+    controller,
+    fasta_path,
+    output_path,
+    cache,
+    links_queue,
+    tables_queue,
+    status,
+    abort,
+):
+    while True:
+        item = get(links_queue, abort)
+        if item is STOP:
+            put(tables_queue, STOP, abort)
+            return
+        batch, names, query, end, links, reused, record = item
+
+        ## the result links are in the same order as the sequences of the query
+        lines = query.split("\n")
+        hashes = [fasta_reader.sequence_hash(seq) for seq in lines[1::2]]
+
+        report(status, "log", batch, "Downloading results.")
+        tables = http_pool.run(engine.as_session(links, session, record))
+
+        expired = [position for position in reused if tables[position] is None]
+        if expired:
+            report(
+                status,
+                "log",
+                batch,
+                "{} saved result links expired, posting them again.".format(
+                    len(expired)
+                ),
+            )
+            posted = post_sequences(
+                engine,
+                lines,
+                expired,
+                session,
+                batch,
+                status,
+                abort,
+                controller,
+                fasta_path,
+                output_path,
+                record,
+            )
+            if posted is None:
+                return
+            retried = http_pool.run(engine.as_session(posted, session, record))
+            for position, link, table in zip(expired, posted, retried):
+                links[position], tables[position] = link, table
+
+        store_pages(engine, cache, hashes, tables)
+
+        failed = [
+            {"name": name, "hash": seq_hash, "url": link}
+            for name, seq_hash, link, table in zip(lines[0::2], hashes, links, tables)
+            if table is None
+        ]
+        if failed:
+            checkpoint.add_failed(fasta_path, output_path, failed)
+            report(
+                status,
+                "log",
+                batch,
+                "{} result pages could not be downloaded.".format(len(failed)),
+            )
+
+        tables = {
+            seq_hash: engine.failed_table() if table is None else table
+            for seq_hash, table in zip(hashes, tables)
+        }
+
+        if not put(tables_queue, (batch, names, end, tables, record), abort):
+            return
+
+
+## third stage: concat the tables, save them and advance the journal
+## batches arrive in order, so the journal always points behind the last saved batch
+## sequences that were not sent to BOLD are taken from the identification cache
+def save_stage(
+    engine, fasta_path, output_path, journal, cache, tables_queue, status, abort
+):
+    ## results of duplicated sequences that are needed again in a later batch
+    known_tables = {}
+    hits, misses = 0, 0
+
+    while True:
+        item = get(tables_queue, abort)
+        if item is STOP:
+            break
+        batch, names, end, tables, record = item
+        misses += len(tables)
+
+        ## load all results of this batch that were found in the cache
+        cached = {
+            seq_hash
+            for name, seq_hash, keep in names
+            if seq_hash not in known_tables and seq_hash not in tables
+        }
+        if cached:
+            tables.update(id_cache.load(cache, engine.SEARCHDB, engine.TABTYPE, cached))
+            hits += len(cached)
+
+        ## damaged cache entries are saved as failed, so a retry requests them again
+        damaged = {
+            seq_hash: {"name": name, "hash": seq_hash, "url": None}
+            for name, seq_hash, keep in names
+            if seq_hash in cached and seq_hash not in tables
+        }
+        if damaged:
+            checkpoint.add_failed(fasta_path, output_path, list(damaged.values()))
+            tables.update({seq_hash: engine.failed_table() for seq_hash in damaged})
+            report(
+                status,
+                "log",
+                batch,
+                "{} cached results were damaged.".format(len(damaged)),
+            )
+
+        report(status, "log", batch, "Saving results.")
+        start = time.monotonic()
+        result = engine.save_as_df(tables, names, known_tables)
+
+        ## results are buffered, the journal is only written once they reach the disk
+        durable = engine.save_results(result, fasta_path, output_path)
+        checkpoint.advance(
+            journal, fasta_path, output_path, names, end, len(result), durable
+        )
+        metrics.add(record, "write_seconds", time.monotonic() - start)
+        metrics.finish(record, len(names))
+        report(
+            status,
+            "saved",
+            batch,
+            "Saved checkpoint." if durable else "Buffered results.",
+            len(names),
+        )
+
+    ## write the rest of the buffer, so the journal covers every saved batch
+    engine.flush_results(fasta_path, output_path)
+    checkpoint.save(journal, fasta_path, output_path)
+
+    ## report the cache usage of this run and keep the cache within its limits
+    if cache is not None:
+        report(
+            status,
+            "log",
+            None,
+            "Identification cache: {} hits, {} misses.".format(hits, misses),
+        )
+        id_cache.evict(cache)
+
+
+## wrapper to hand any unexpected error of a stage to the controlling thread
+def guarded(stage, status, abort):
+    def run(*args):
+        try:
+            stage(*args)
+        except Exception as error:
+            abort.set()
+            report(status, "error", None, error)
+
+    return run
+
+
+## function to format a status message for the user, messages without a batch belong to the whole run
+def describe(batch, message):
+    return message if batch is None else "Batch {}: {}".format(batch + 1, message)
+
+
+## function to run the identification of all batches as a pipeline
+## while batch n is saved, batch n + 1 is downloaded and batch n + 2 is already posted to BOLD
+## batches is an iterable of (names, query, end) as returned by fasta_reader.fasta_batches
+## the controller is the batch_control controller the batches take their size from
+## cache is the id_cache connection every downloaded page is saved in
+## saved_links are the result links an interrupted run received in form of {sequence hash: url}
+## the journal is advanced after every saved batch, so an interrupted run can be resumed
+## yields tuples of (kind, batch, message, finished records) to report the progress to the caller
+def run(
+    engine,
+    session,
+    batches,
+    fasta_path,
+    output_path,
+    journal,
+    controller,
+    cache,
+    saved_links=None,
+    queue_size=1,
+):
+    ## bounded queues between the stages, so no stage runs too far ahead
+    links_queue = queue.Queue(maxsize=queue_size)
+    tables_queue = queue.Queue(maxsize=queue_size)
+    status = queue.Queue()
+    abort = threading.Event()
+
+    stages = [
+        (
+            post_stage,
+            (
+                engine,
+                session,
+                controller,
+                batches,
+                journal["batches"],
+                saved_links or {},
+                fasta_path,
+                output_path,
+                links_queue,
+                status,
+                abort,
+            ),
+        ),
+        (
+            download_stage,
+            (
+                engine,
+                session,
+                controller,
+                fasta_path,
+                output_path,
+                cache,
+                links_queue,
+                tables_queue,
+                status,
+                abort,
+            ),
+        ),
+        (
+            save_stage,
+            (
+                engine,
+                fasta_path,
+                output_path,
+                journal,
+                cache,
+                tables_queue,
+                status,
+                abort,
+            ),
+        ),
+    ]
+    threads = [
+        threading.Thread(target=guarded(stage, status, abort), args=args, daemon=True)
+        for stage, args in stages
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    ## forward the status messages of the stages until all of them are done
+    finished = journal["records"]
+    try:
+        while any(thread.is_alive() for thread in threads) or not status.empty():
+            try:
+                kind, batch, message, records = status.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == "error":
+                raise message
+            finished += records
+            yield kind, batch, message, finished
+    finally:
+        abort.set()
+
+
+## function to consume the progress of one job in its own thread, see concurrent
+def consume(job, progress, status, stop):
+    try:
+        for kind, batch, message, finished in progress:
+            status.put((job, kind, batch, message, finished))
+            if stop.is_set():
+                progress.close()
+                return
+    except Exception as error:
+        status.put((job, "error", None, error, 0))
+        return
+
+    status.put((job, STOP, None, None, 0))
+
+
+## function to run several jobs (e.g. shards or markers) at the same time
+## jobs is a list of (label, progress) where progress is a generator like identify
+## every job runs in its own thread, all of them share the event loop and connection pool
+## yields the progress of all jobs, messages are prefixed with the label of their job
+## and finished is the sum of the finished records of all jobs
+def concurrent(jobs):
+    status, stop = queue.Queue(), threading.Event()
+
+    for job, (label, progress) in enumerate(jobs):
+        threading.Thread(
+            target=consume, args=(job, progress, status, stop), daemon=True
+        ).start()
+
+    finished, running = [0] * len(jobs), len(jobs)
+    try:
+        while running:
+            job, kind, batch, message, records = status.get()
+            if kind == "error":
+                raise message
+            if kind is STOP:
+                running -= 1
+                continue
+            finished[job] = records
+            message = "{}: {}".format(jobs[job][0], describe(batch, message))
+            yield kind, None, message, sum(finished)
+    finally:
+        stop.set()
+
+
+## function to download the results of a whole fasta file with one of the engine modules
+## resumes an interrupted run from its journal, yields the same progress tuples as run
+## the journal is returned but not finished, so the results can still be processed further
+def download(engine, session, fasta_path, output_path, query_length, use_cache=True):
+    ## pages are saved once their batch is downloaded, without the identification cache
+    ## they are kept in a store of this run only, which is removed once the run is finished
+    cache = id_cache.open_cache(
+        None if use_cache else checkpoint.pages_path(fasta_path, output_path)
+    )
+    ## the cache is closed in any case, also if a stage fails or the caller stops early
+    try:
+        cached = partial(id_cache.cached, cache, engine.SEARCHDB, engine.TABTYPE)
+
+        ## query_length is the largest batch size, smaller batches are used if BOLD struggles
+        controller = batch_control.new_controller(query_length)
+
+        ## continue where the last run stopped, results of unfinished batches are removed
+        ## the run starts from the beginning if the results of the journal are not there anymore
+        journal = checkpoint.resume(fasta_path, output_path)
+        location = engine.results_location(fasta_path, output_path)
+        if journal["batches"] and (
+            journal.get("results", location) != location
+            or engine.count_results(fasta_path, output_path) < journal["rows"]
+        ):
+            message = "The saved results do not match the journal, starting again."
+            yield "log", None, message, 0
+            journal = checkpoint.new_journal(fasta_path)
+        journal["results"] = location
+        engine.truncate_results(fasta_path, output_path, journal["rows"])
+        if journal["batches"] == 0:
+            checkpoint.clear_failed(fasta_path, output_path)
+        batches = fasta_reader.fasta_batches(
+            fasta_path,
+            partial(batch_control.size, controller),
+            cached,
+            journal["offset"],
+        )
+
+        ## result links of an interrupted run are downloaded without posting the sequences again
+        yield from run(
+            engine,
+            session,
+            batches,
+            fasta_path,
+            output_path,
+            journal,
+            controller,
+            cache,
+            checkpoint.read_links(fasta_path, output_path),
+        )
+    finally:
+        cache.close()
+
+    return journal
+
+
+## function to run the whole identification of a fasta file with one of the engine modules
+## resumes an interrupted run from its journal and converts the results to excel in the end
+## yields the same progress tuples as run, so it can be driven by the gui or the command line
+def identify(engine, session, fasta_path, output_path, query_length, use_cache=True):
+    journal = yield from download(
+        engine, session, fasta_path, output_path, query_length, use_cache
+    )
+
+    ## sequences of failed result pages are saved with the status Failed
+    failed = checkpoint.read_failed(fasta_path, output_path)
+    if failed:
+        message = "{} result pages could not be downloaded and are marked as failed."
+        yield "log", None, message.format(len(failed)), journal["records"]
+
+    ## index and compress the results once, before the run is marked as finished
+    yield "log", None, "Finalizing the results.", journal["records"]
+    engine.finalize_results(fasta_path, output_path)
+    checkpoint.finish(journal, fasta_path, output_path)
+
+    ## convert results to excel when download is finished
+    yield "log", None, "Converting the data to excel.", journal["records"]
+    engine.excel_converter(fasta_path, output_path)
@@ -0,0 +1,100 @@
+import io, re
+import lxml.html
+import numpy as np
+import pandas as pd
+from lxml import etree
+from bs4 import BeautifulSoup as BSoup
+
+## same whitespace handling as pandas.read_html to get identical cell values
+WHITESPACE = re.compile(r"[\r\n]+|\s{2,}")
+
+## finds the process ids of all published records on a result page
+PUBLIC_RECORDS = (
+    "//*[contains(concat(' ', normalize-space(@class), ' '), ' publicrecord ')]/@id"
+)
+
+
+## function to convert a single cell, empty cells become np.nan like in pandas
+def convert(value, converter=None):
+    if value is None or value == "" or (isinstance(value, float) and np.isnan(value)):
+        return np.nan
+    return converter(value) if converter else value
+
+
+## function to add the process ids to all published records of the table
+def add_process_ids(table, ids):
+    ids = iter(ids)
+    table["Process_ID"] = [
+        next(ids, np.nan) if status else np.nan
+        for status in np.where(table["Status"] == "Published", True, False)
+    ]
+
+    return table
+
+
+## function to parse a result page in a single pass with the compiled lxml parser
+## raises ValueError if the page does not look like a valid result page
+def parse_lxml(html, columns, converters):
+    try:
+        document = lxml.html.fromstring(html)
+    except etree.LxmlError:
+        raise ValueError("Result page could not be parsed.")
+
+    ## only count tables with content, pandas skips empty ones as well
+    tables = [
+        table for table in document.iter("table") if table.find(".//tr") is not None
+    ]
+    if not tables:
+        raise ValueError("No tables found")
+    if len(tables) < 3:
+        return None
+
+    ## the first row holds the header, all other rows are hits
+    rows = tables[1].xpath("./tr | ./thead/tr | ./tbody/tr | ./tfoot/tr")[1:]
+    rows = [
+        [
+            WHITESPACE.sub(" ", cell.text_content().strip())
+            for cell in row.xpath("./td | ./th")
+        ]
+        for row in rows
+    ]
+    if any(len(row) != len(columns) for row in rows):
+        raise ValueError("Malformed result table")
+
+    ## write every column with its final type directly into the table
+    table = pd.DataFrame(
+        {
+            column: [convert(row[position], converters.get(column)) for row in rows]
+            for position, column in enumerate(columns)
+        },
+        columns=columns,
+    )
+
+    return add_process_ids(table, document.xpath(PUBLIC_RECORDS))
+
+
+## slow but forgiving fallback parser for malformed pages
+## newer pandas versions only read html from files, so the page is wrapped in one
+def parse_html5lib(html, columns, converters):
+    tables = pd.read_html(io.StringIO(html), header=0, flavor="html5lib")
+    if len(tables) < 3:
+        return None
+
+    table = tables[1]
+    table.columns = columns
+    for column, converter in converters.items():
+        table[column] = [convert(value, converter) for value in table[column]]
+
+    ids = BSoup(html, "html5lib")
+    ids = [tag.get("id") for tag in ids.find_all(class_="publicrecord")]
+
+    return add_process_ids(table, ids)
+
+
+## function to parse a BOLD result page
+## returns the result table including the process ids or None if the page holds no result
+def parse_page(html, columns, converters):
+    try:
+        return parse_lxml(html, columns, converters)
+    except ValueError:
+        return parse_html5lib(html, columns, converters)
@@ -0,0 +1,328 @@
+import os, json, ntpath, threading, time
+import numpy as np
+import pandas as pd
+
+## format the results are saved in while runtime, they are converted to excel in the end
+## "hdf" appends every batch to a pytables table, "parquet" writes every batch as a parquet file
+backend = os.environ.get("BOLDIGGER_RESULTS_BACKEND", "hdf")
+BACKENDS = ["hdf", "parquet"]
+
+## size limits for the text columns of the hdf file, should cover most taxa names
+SIZES = {
+    "You_searched_for": 100,
+    "Phylum": 80,
+    "Class": 80,
+    "Order": 80,
+    "Family": 80,
+    "Genus": 80,
+    "Species": 80,
+    "Subspecies": 80,
+    "Status": 15,
+    "Process_ID": 25,
+}
+
+## results are collected in memory up to this number of bytes before they are written to disk
+buffer_size = 64 * 1024**2
+
+## the buffer is written at least every this many seconds, the journal only advances with it
+## so a crash never repeats more than this time of work
+flush_interval = 60
+
+## results that are not written yet in form of {savename: {"marker", "frames", "size", "started"}}
+_buffers = {}
+_lock = threading.Lock()
+
+## columns with only a few different values, they are dictionary encoded in parquet
+TAXONOMY = ["Phylum", "Class", "Order", "Family", "Genus", "Species", "Status"]
+
+
+## function to change the results backend, the size of the write buffer and its flush interval
+## has to be called before a run is started
+def configure(name=None, buffer=None, interval=None):
+    global backend, buffer_size, flush_interval
+
+    if name is not None and name not in BACKENDS:
+        raise ValueError("Unknown results backend: {}".format(name))
+    backend = name if name is not None else backend
+    buffer_size = buffer if buffer is not None else buffer_size
+    flush_interval = interval if interval is not None else flush_interval
+
+
+## function to return the path the results of a fasta are saved in while runtime
+## savename is always BOLDResults_ + name of fasta that is searched for
+def path(fasta_path, output_path):
+    return os.path.join(
+        output_path,
+        "BOLDResults_{}.{}".format(
+            ntpath.splitext(ntpath.basename(fasta_path))[0],
+            "h5.lz" if backend == "hdf" else "parquet",
+        ),
+    )
+
+
+## function to return where the results of a fasta are saved, it is kept in the journal
+## so a resumed run notices if the backend has been changed in the meantime
+def location(fasta_path, output_path):
+    return {
+        "backend": backend,
+        "path": os.path.abspath(path(fasta_path, output_path)),
+    }
+
+
+## function to make sure a written file is on disk before the journal points behind it
+def sync(file_path):
+    with open(file_path, "rb") as written:
+        os.fsync(written.fileno())
+
+
+## function to append results to the hdf output file
+## a fast compression is used and no indexes are maintained, both happen once in hdf_finalize
+def hdf_append(dataframe, savename):
+    with pd.HDFStore(savename, mode="a", complib="blosc:lz4", complevel=1) as storage:
+        storage.append(
+            "results",
+            dataframe,
+            format="t",
+            data_columns=True,
+            index=False,
+            min_itemsize=SIZES,
+            complib="blosc:lz4",
+            complevel=1,
+        )
+
+    sync(savename)
+
+
+## function to compress the hdf output file and index all columns once all results are saved
+## the table is copied to a new file like ptrepack does, so no unused space is left
+def hdf_finalize(savename):
+    import tables
+
+    tables.copy_file(
+        savename,
+        savename + ".tmp",
+        overwrite=True,
+        filters=tables.Filters(complevel=9, complib="blosc:blosclz"),
+    )
+    os.replace(savename + ".tmp", savename)
+
+    with pd.HDFStore(savename, mode="a") as storage:
+        if "results" in storage:
+            storage.create_table_index("results", columns=True, optlevel=9, kind="full")
+
+
+## function to remove all rows behind rows from the hdf output file
+def hdf_truncate(savename, rows):
+    with pd.HDFStore(savename, mode="a") as storage:
+        if "results" not in storage:
+            return
+        elif rows == 0:
+            storage.remove("results")
+        elif storage.get_storer("results").nrows > rows:
+            storage.remove("results", start=rows)
+
+
+## generator to read the hdf output file in chunks
+def hdf_chunks(savename, columns, chunksize):
+    with pd.HDFStore(savename, mode="r") as storage:
+        if "results" not in storage:
+            return
+        yield from storage.select("results", columns=columns, chunksize=chunksize)
+
+
+## function to read the manifest of a parquet output, it lists all parts in order
+def read_manifest(savename):
+    try:
+        with open(os.path.join(savename, "manifest.json"), "r") as manifest:
+            return json.load(manifest)
+    except OSError:
+        return {"parts": []}
+
+
+## function to write the manifest, the old manifest is replaced in a single step
+def write_manifest(savename, manifest):
+    manifest_path = os.path.join(savename, "manifest.json")
+
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+## function to write the results of a batch as a new part of the parquet output
+## numeric columns get a real numeric type, empty values are saved as nulls
+def parquet_append(marker, dataframe, savename):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(savename, exist_ok=True)
+    manifest = read_manifest(savename)
+
+    arrays = []
+    for column in dataframe.columns:
+        converter = marker["converters"].get(column)
+        if converter:
+            values = pd.to_numeric(
+                dataframe[column].replace("", np.nan), errors="coerce"
+            )
+            arrow_type = pa.int64() if converter is int else pa.float64()
+        else:
+            values, arrow_type = dataframe[column], pa.string()
+        arrays.append(pa.array(values, type=arrow_type, from_pandas=True))
+    table = pa.Table.from_arrays(arrays, names=list(dataframe.columns))
+
+    ## every flush of the buffer is a single row group
+    part = "part_{:05d}.parquet".format(len(manifest["parts"]) + 1)
+    pq.write_table(
+        table,
+        os.path.join(savename, part),
+        compression="zstd",
+        use_dictionary=[column for column in TAXONOMY if column in dataframe.columns],
+        row_group_size=max(1, len(table)),
+    )
+    sync(os.path.join(savename, part))
+
+    manifest["parts"].append({"file": part, "rows": len(table)})
+    write_manifest(savename, manifest)
+
+
+## function to remove all rows behind rows from the parquet output
+def parquet_truncate(savename, rows):
+    import pyarrow.parquet as pq
+
+    manifest, kept, total = read_manifest(savename), [], 0
+
+    for part in manifest["parts"]:
+        part_path = os.path.join(savename, part["file"])
+        if total >= rows:
+            if os.path.isfile(part_path):
+                os.remove(part_path)
+            continue
+
+        ## parts end at checkpoints, so this only happens if the journal was edited
+        if total + part["rows"] > rows:
+            table = pq.read_table(part_path).slice(0, rows - total)
+            pq.write_table(table, part_path, compression="zstd")
+            part = dict(part, rows=rows - total)
+
+        kept.append(part)
+        total += part["rows"]
+
+    write_manifest(savename, dict(manifest, parts=kept))
+
+
+## generator to read the parquet output lazily, only the given columns are read from disk
+def parquet_chunks(savename, columns, chunksize):
+    import pyarrow.parquet as pq
+
+    for part in read_manifest(savename)["parts"]:
+        parquet_file = pq.ParquetFile(os.path.join(savename, part["file"]))
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+
+
+## function to save the results of a batch with the configured backend
+## the results are buffered and written once the buffer is full or flush_interval has passed
+## returns True if the buffer has been written, so the journal can be saved
+def append(marker, dataframe, fasta_path, output_path):
+    ## make all nan text columns compatible with the output format
+    cols = marker["fill"] + ["Process_ID"]
+    dataframe[cols] = dataframe[cols].fillna(value="")
+
+    ## numeric columns get the same type in every batch, the hdf table does not accept a change
+    for column in marker["converters"]:
+        dataframe[column] = pd.to_numeric(dataframe[column], errors="coerce").astype(
+            float
+        )
+
+    with _lock:
+        buffer = _buffers.setdefault(
+            path(fasta_path, output_path),
+            {"marker": marker, "frames": [], "size": 0, "started": time.monotonic()},
+        )
+        buffer["frames"].append(dataframe)
+        buffer["size"] += dataframe.memory_usage(deep=True).sum()
+        full = (
+            buffer["size"] >= buffer_size
+            or time.monotonic() - buffer["started"] >= flush_interval
+        )
+
+    if full:
+        flush(fasta_path, output_path)
+    return full
+
+
+## function to write all buffered results of a fasta to disk
+def flush(fasta_path, output_path):
+    savename = path(fasta_path, output_path)
+
+    with _lock:
+        buffer = _buffers.pop(savename, None)
+    if not buffer:
+        return
+
+    dataframe = pd.concat(buffer["frames"], axis=0)
+    if backend == "hdf":
+        hdf_append(dataframe, savename)
+    else:
+        parquet_append(buffer["marker"], dataframe, savename)
+
+
+## function to write the remaining results and prepare the output for reading
+## the hdf output is compressed and indexed only now, parquet parts are final already
+def finalize(fasta_path, output_path):
+    flush(fasta_path, output_path)
+    savename = path(fasta_path, output_path)
+
+    if backend == "hdf" and os.path.isfile(savename):
+        hdf_finalize(savename)
+
+
+## function to remove results that were written after the last checkpoint of the journal
+## they belong to a batch that did not finish and will be requested again
+def truncate(fasta_path, output_path, rows):
+    savename = path(fasta_path, output_path)
+
+    ## buffered results of an aborted run in the same process are dropped as well
+    with _lock:
+        _buffers.pop(savename, None)
+
+    if not os.path.exists(savename):
+        return
+
+    if backend == "hdf":
+        hdf_truncate(savename, rows)
+    else:
+        parquet_truncate(savename, rows)
+
+
+## function to count the rows that are saved on disk, buffered rows are not counted
+def count(fasta_path, output_path):
+    savename = path(fasta_path, output_path)
+
+    if not os.path.exists(savename):
+        return 0
+
+    if backend == "hdf":
+        with pd.HDFStore(savename, mode="r") as storage:
+            if "results" not in storage:
+                return 0
+            return storage.get_storer("results").nrows
+    else:
+        return sum(part["rows"] for part in read_manifest(savename)["parts"])
+
+
+## generator to read the saved results in chunks of dataframes
+## columns selects the columns to read, None reads all of them
+def chunks(fasta_path, output_path, columns=None, chunksize=50000):
+    savename = path(fasta_path, output_path)
+
+    if not os.path.exists(savename):
+        return
+
+    if backend == "hdf":
+        yield from hdf_chunks(savename, columns, chunksize)
+    else:
+        yield from parquet_chunks(savename, columns, chunksize)
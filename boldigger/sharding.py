@@ -0,0 +1,113 @@
+import os, ntpath, filecmp, shutil
+from boldigger import pipeline, fasta_reader, checkpoint, results_store
+
+## function to return the folder the shards of a fasta and their results are saved in
+def shard_folder(fasta_path, output_path):
+    return os.path.join(
+        output_path,
+        "BOLDResults_{}_shards".format(
+            ntpath.splitext(ntpath.basename(fasta_path))[0]
+        ),
+    )
+
+
+## function to split a fasta into consecutive shards of about the same number of records
+## shards that did not change since the last run are not rewritten, so their journals stay valid
+## returns the paths of the shard fastas in the order of the input
+def split_fasta(fasta_path, output_path, shards):
+    folder = shard_folder(fasta_path, output_path)
+    os.makedirs(folder, exist_ok=True)
+
+    records = fasta_reader.count_records(fasta_path)
+    shard_size = max(1, -(-records // shards))
+    stem = ntpath.splitext(ntpath.basename(fasta_path))[0]
+    paths, output = [], None
+
+    for count, (name, sequence, end) in enumerate(
+        fasta_reader.read_records(fasta_path)
+    ):
+        if count % shard_size == 0:
+            if output:
+                output.close()
+            paths.append(
+                os.path.join(folder, "{}_shard_{}.fasta".format(stem, len(paths) + 1))
+            )
+            output = open(paths[-1] + ".tmp", "w")
+        output.write("{}\n{}\n".format(name, sequence))
+
+    if output:
+        output.close()
+
+    for path in paths:
+        if os.path.isfile(path) and filecmp.cmp(path + ".tmp", path, shallow=False):
+            os.remove(path + ".tmp")
+        else:
+            os.replace(path + ".tmp", path)
+
+    return paths
+
+
+## function to merge the results of all shards into the result file of the fasta
+## the shards are appended in order, so the results keep the order of the input
+def merge_results(engine, fasta_path, output_path, shard_paths, chunksize=100000):
+    folder = shard_folder(fasta_path, output_path)
+    engine.truncate_results(fasta_path, output_path, 0)
+
+    for shard_path in shard_paths:
+        for chunk in results_store.chunks(shard_path, folder, chunksize=chunksize):
+            engine.save_results(chunk, fasta_path, output_path)
+
+    engine.finalize_results(fasta_path, output_path)
+
+
+## function to run the identification of a fasta with several sessions at the same time
+## the fasta is split into one shard per session, every shard has its own journal and results
+## once all shards are done their results are merged in the original order and converted to excel
+## the shard folder is removed after the merge, keep_shards keeps it e.g. to look at single shards
+## yields the same progress tuples as pipeline.identify, the messages name their shard
+def identify(
+    engine,
+    sessions,
+    fasta_path,
+    output_path,
+    query_length,
+    use_cache=True,
+    keep_shards=False,
+):
+    shard_paths = split_fasta(fasta_path, output_path, len(sessions))
+    folder = shard_folder(fasta_path, output_path)
+
+    yield from pipeline.concurrent(
+        [
+            (
+                "Shard {}".format(shard + 1),
+                pipeline.download(
+                    engine, session, shard_path, folder, query_length, use_cache
+                ),
+            )
+            for shard, (session, shard_path) in enumerate(zip(sessions, shard_paths))
+        ]
+    )
+
+    finished = fasta_reader.count_records(fasta_path)
+    yield "log", None, "Merging the results of all shards.", finished
+    merge_results(engine, fasta_path, output_path, shard_paths)
+
+    ## the failed lists of the shards are merged as well, so they can be retried on the fasta
+    checkpoint.clear_failed(fasta_path, output_path)
+    for shard_path in shard_paths:
+        failed = checkpoint.read_failed(shard_path, folder)
+        if failed:
+            checkpoint.add_failed(fasta_path, output_path, failed)
+
+    ## the shards are only finished once their results are merged
+    ## their results are a second copy of the merged results, so they are removed
+    if keep_shards:
+        for shard_path in shard_paths:
+            journal = checkpoint.resume(shard_path, folder)
+            checkpoint.finish(journal, shard_path, folder)
+    else:
+        shutil.rmtree(folder)
+
+    yield "log", None, "Converting the data to excel.", finished
+    engine.excel_converter(fasta_path, output_path)
@@ -0,0 +1,98 @@
+import os, json, time
+from boldigger import sqlite_cache
+
+## where specimen records are kept, how long they are trusted (30 days) and how much space they
+## may take (256 MB), set with BOLDIGGER_SPECIMEN_CACHE, _DAYS and _MB
+## specimen data changes more often than identification results, e.g. if a BIN is reassigned
+path, ttl, max_size = sqlite_cache.settings(
+    "BOLDIGGER_SPECIMEN_CACHE", "specimen_cache.sqlite", 30, 256
+)
+
+## fields of a specimen record that are cached, the taxonomy comes from the json api
+FIELDS = [
+    "record_id",
+    "bin_uri",
+    "sex",
+    "lifestage",
+    "country",
+    "identification_provided_by",
+    "identification_method",
+    "institution_storing",
+    "phylum",
+    "class",
+    "order",
+    "family",
+]
+
+
+## function to change where specimen records are kept and for how long, e.g. from a script
+## that downloads additional data without the gui, has to be called before open_cache
+def configure(cache_path=None, max_age=None, size=None):
+    global path, ttl, max_size
+
+    path = cache_path if cache_path is not None else path
+    ttl = max_age if max_age is not None else ttl
+    max_size = size if size is not None else max_size
+
+
+## function to open the specimen cache, the table of records is created on first use
+def open_cache():
+    return sqlite_cache.open_database(
+        path,
+        [
+            "CREATE TABLE IF NOT EXISTS specimens (processid TEXT PRIMARY KEY, "
+            "created REAL, size INTEGER, data TEXT)",
+            "CREATE INDEX IF NOT EXISTS specimens_created ON specimens (created)",
+        ],
+    )
+
+
+## generator to query the cache for many process ids at once
+## yields (processid, fields) of all records that are younger than created
+def select(connection, process_ids, created):
+    for process_id, data in sqlite_cache.select(
+        connection,
+        "SELECT processid, data FROM specimens WHERE created > ? "
+        "AND processid IN ({})",
+        [created],
+        process_ids,
+    ):
+        yield process_id, json.loads(data)
+
+
+## function to load the cached records of the given process ids
+## only records that hold all of the requested fields are returned, the others have to be requested
+## returns a dict in form of {processid: {field: value}}
+def load(connection, process_ids, fields):
+    return {
+        process_id: record
+        for process_id, record in select(connection, process_ids, time.time() - ttl)
+        if all(field in record for field in fields)
+    }
+
+
+## function to store specimen records, records is a dict in form of {processid: {field: value}}
+## fields that are already cached for a process id are kept while they are valid,
+## so the xml and the json api can fill the same record
+def store(connection, records):
+    if not records:
+        return
+
+    known = dict(select(connection, records, time.time() - ttl))
+    now = time.time()
+    rows = []
+
+    for process_id, record in records.items():
+        record = dict(
+            known.get(process_id, {}),
+            **{field: value for field, value in record.items() if field in FIELDS}
+        )
+        data = json.dumps(record)
+        rows.append((process_id, now, len(data), data))
+
+    sqlite_cache.insert(connection, "specimens", rows)
+
+
+## function to remove expired records and the oldest records if the cache grows too big
+def evict(connection):
+    sqlite_cache.evict(connection, "specimens", ttl, max_size)
@@ -0,0 +1,149 @@
+import os, csv, gzip
+from boldigger import sqlite_cache
+
+## location of the store for downloaded BOLD data packages, shared by all runs and projects
+## in contrast to the specimen cache its records never expire, they are replaced by a new ingest
+path = os.environ.get(
+    "BOLDIGGER_SPECIMEN_STORE",
+    os.path.join(sqlite_cache.FOLDER, "specimen_store.sqlite"),
+)
+
+## fields of a specimen record and the columns they are read from in a data package
+## the first column found in the header is used, so packages of the old and the new
+## BOLD data portal can both be ingested
+COLUMNS = {
+    "record_id": ["record_id", "recordID", "recordid"],
+    "bin_uri": ["bin_uri"],
+    "sex": ["sex"],
+    "lifestage": ["lifestage", "life_stage"],
+    "country": ["country", "country/ocean"],
+    "identification_provided_by": ["identification_provided_by", "identified_by"],
+    "identification_method": ["identification_method"],
+    "institution_storing": ["institution_storing", "inst"],
+    "phylum": ["phylum_name", "phylum"],
+    "class": ["class_name", "class"],
+    "order": ["order_name", "order"],
+    "family": ["family_name", "family"],
+}
+FIELDS = list(COLUMNS)
+
+## rows that are written to the store in a single transaction
+CHUNKSIZE = 50000
+
+## some columns of the data packages hold long notes
+csv.field_size_limit(2**31 - 1)
+
+
+## function to change the location of the store, has to be called before the store is opened
+def configure(store_path=None):
+    global path
+
+    path = store_path if store_path is not None else path
+
+
+## function to open the store, returns None if no data package has been ingested yet
+## the process id is the primary key of a table without rowid, so it is the index of the table
+def open_store(create=False):
+    if not create and not os.path.isfile(path):
+        return None
+
+    return sqlite_cache.open_database(
+        path,
+        [
+            "CREATE TABLE IF NOT EXISTS specimens (processid TEXT PRIMARY KEY, {}) "
+            "WITHOUT ROWID".format(
+                ", ".join('"{}" TEXT'.format(field) for field in FIELDS)
+            )
+        ],
+    )
+
+
+## function to open a data package, gzipped packages are read without unpacking them first
+def open_package(package_path):
+    if package_path.endswith(".gz"):
+        return gzip.open(package_path, "rt", encoding="utf-8", errors="replace")
+    return open(package_path, "r", encoding="utf-8", errors="replace", newline="")
+
+
+## function to find the position of every field in the header of a data package
+## fields that are not part of the package are left out and stay empty in the store
+def header_positions(header):
+    if "processid" not in header:
+        raise ValueError("The data package has no processid column.")
+
+    positions = {}
+    for field, columns in COLUMNS.items():
+        for column in columns:
+            if column in header:
+                positions[field] = header.index(column)
+                break
+
+    return header.index("processid"), positions
+
+
+## generator to read the records of a data package as rows of the store
+## the package is streamed line by line, so its size is only limited by the disk
+def read_package(package_path):
+    with open_package(package_path) as package:
+        reader = csv.reader(package, delimiter="\t", quoting=csv.QUOTE_NONE)
+        processid, positions = header_positions(next(reader, []))
+
+        for line in reader:
+            if len(line) <= processid or not line[processid]:
+                continue
+            yield [line[processid]] + [
+                line[positions[field]]
+                if field in positions and positions[field] < len(line)
+                else ""
+                for field in FIELDS
+            ]
+
+
+## function to ingest a downloaded BOLD data package in tsv format into the store
+## records that are already in the store are replaced by the new package
+## progress is called with the number of ingested records after every chunk
+## returns the number of ingested records
+def ingest(package_path, progress=None):
+    connection = open_store(create=True)
+    rows, total = [], 0
+
+    for row in read_package(package_path):
+        rows.append(row)
+        if len(rows) == CHUNKSIZE:
+            sqlite_cache.insert(connection, "specimens", rows)
+            total, rows = total + len(rows), []
+            if progress is not None:
+                progress(total)
+
+    sqlite_cache.insert(connection, "specimens", rows)
+    total += len(rows)
+    connection.close()
+
+    return total
+
+
+## function to load the records of the given process ids from the store
+## returns a dict in form of {processid: {field: value}}
+def load(connection, process_ids, fields):
+    columns = ", ".join('"{}"'.format(field) for field in fields)
+    rows = sqlite_cache.select(
+        connection,
+        "SELECT processid, " + columns + " FROM specimens WHERE processid IN ({})",
+        [],
+        process_ids,
+    )
+
+    return {row[0]: dict(zip(fields, row[1:])) for row in rows}
+
+
+## function to look up process ids without any network traffic
+## returns an empty dict if no data package has been ingested, the ids are requested from BOLD then
+def lookup(process_ids, fields):
+    connection = open_store()
+    if connection is None:
+        return {}
+
+    try:
+        return load(connection, process_ids, fields)
+    finally:
+        connection.close()
@@ -0,0 +1,87 @@
+import os, time, sqlite3, threading
+
+## sqlite connections are shared between threads, all caches use the same lock
+lock = threading.Lock()
+
+## sqlite limits the number of parameters of a query, keys are queried in packs of this size
+PACK_SIZE = 500
+
+## folder the caches are kept in by default, shared by all runs and projects
+FOLDER = os.path.join(os.path.expanduser("~"), ".boldigger")
+
+
+## function to read the location, maximum age and size of a cache from the environment
+## variable holds the path, variable_DAYS the age in days and variable_MB the size in megabytes
+## unset variables fall back to the file name in FOLDER, days and megabytes
+## returns (path, maximum age in seconds, maximum size in bytes)
+def settings(variable, filename, days, megabytes):
+    return (
+        os.environ.get(variable, os.path.join(FOLDER, filename)),
+        float(os.environ.get(variable + "_DAYS", days)) * 24 * 60 * 60,
+        int(float(os.environ.get(variable + "_MB", megabytes)) * 1024**2),
+    )
+
+
+## function to open a cache database, creates the folder and the tables if they do not exist yet
+## statements are the CREATE statements of the tables and indexes of the cache
+def open_database(path, statements):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False)
+
+    with lock, connection:
+        for statement in statements:
+            connection.execute(statement)
+
+    return connection
+
+
+## generator to query a cache for many keys at once
+## query holds a {} where the placeholders of the keys are inserted, parameters come before them
+## yields the rows of all packs
+def select(connection, query, parameters, keys):
+    keys = list(keys)
+
+    for start in range(0, len(keys), PACK_SIZE):
+        key_pack = keys[start : start + PACK_SIZE]
+        with lock:
+            rows = connection.execute(
+                query.format(", ".join("?" * len(key_pack))), parameters + key_pack
+            ).fetchall()
+        yield from rows
+
+
+## function to write rows to a table of a cache in a single transaction
+def insert(connection, table, rows):
+    rows = list(rows)
+    if not rows:
+        return
+
+    with lock, connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO {} VALUES ({})".format(
+                table, ", ".join("?" * len(rows[0]))
+            ),
+            rows,
+        )
+
+
+## function to remove expired rows and the oldest rows if a cache grows too big
+## the table needs a created and a size column
+def evict(connection, table, ttl, max_size):
+    with lock, connection:
+        connection.execute(
+            "DELETE FROM {} WHERE created <= ?".format(table), (time.time() - ttl,)
+        )
+
+        ## keep the newest rows until the size limit is reached
+        total, outdated = 0, []
+        for rowid, size in connection.execute(
+            "SELECT rowid, size FROM {} ORDER BY created DESC".format(table)
+        ):
+            total += size
+            if total > max_size:
+                outdated.append((rowid,))
+
+        connection.executemany(
+            "DELETE FROM {} WHERE rowid = ?".format(table), outdated
+        )
@@ -22,17 +22,16 @@ setuptools.setup(
         "numpy >= 1.16.4",
         "pandas >= 0.25.0",
         "requests >= 2.22.0",
-        "more-itertools >= 7.2.0",
         "lxml >= 4.3.3",
         "html5lib >= 1.0.1",
         "xlrd >= 1.2.0",
         "luddite >= 1.0.1",
         "biopython >= 1.78",
         "joblib >= 1.1.0",
-        "psutil >= 5.8.0",
         "tqdm >= 4.56.0",
         "tables >= 3.7.0",
     ],
+    extras_require={"parquet": ["pyarrow >= 7.0.0"]},
     include_package_data=True,
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -42,7 +41,7 @@ setuptools.setup(
     python_requires=">=3.6",
     entry_points={
         "console_scripts": [
-            "boldigger = boldigger.__main__:main",
+            "boldigger = boldigger.cli:main",
         ]
     },
 )
@@ -0,0 +1,232 @@
+import glob, os, sys
+import openpyxl
+import pytest
+from boldigger import (
+    checkpoint,
+    cli,
+    fasta_reader,
+    http_pool,
+    id_cache,
+    markers,
+    pipeline,
+    results_store,
+)
+
+## the mock server lives next to the benchmarks, it answers every request BOLDigger sends
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+import mock_bold, benchmark
+
+RESTARTED = "The saved results do not match the journal, starting again."
+
+
+## the mock server is started once for all tests, requests are not rate limited against it
+@pytest.fixture(scope="module")
+def server():
+    server = mock_bold.start()
+    base_url, rate_limit = http_pool.base_url, http_pool.rate_limit
+    http_pool.configure(base=server.url, rate=10000)
+
+    yield server
+
+    http_pool.base_url, http_pool.rate_limit = base_url, rate_limit
+    server.shutdown()
+
+
+## every test gets its own identification cache and the default results settings
+@pytest.fixture(autouse=True)
+def settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(id_cache, "path", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(results_store, "backend", "hdf")
+    monkeypatch.setattr(results_store, "buffer_size", results_store.buffer_size)
+    monkeypatch.setattr(results_store, "flush_interval", results_store.flush_interval)
+
+
+## function to write a fasta with random sequences into the folder of a test
+def make_fasta(tmp_path, records, duplicates=0.1):
+    fasta_path = str(tmp_path / "reads.fasta")
+    benchmark.make_fasta(fasta_path, records, duplicates)
+
+    return fasta_path
+
+
+## function to run the identification to the end, returns all progress messages
+def identify(fasta_path, output_path, batch_size=10, engine=None):
+    progress = pipeline.identify(
+        engine or markers.engine("coi"),
+        http_pool.get_session(),
+        fasta_path,
+        output_path,
+        batch_size,
+    )
+
+    return [message for kind, batch, message, finished in progress]
+
+
+## function to stop a run after the given number of batches, like a crash of BOLDigger
+## every batch is written to disk at once, so the journal holds all saved batches
+def crash(fasta_path, output_path, batches, batch_size=10):
+    results_store.configure("hdf", 0)
+    progress = pipeline.identify(
+        markers.engine("coi"),
+        http_pool.get_session(),
+        fasta_path,
+        output_path,
+        batch_size,
+    )
+
+    saved = 0
+    for kind, batch, message, finished in progress:
+        saved += kind == "saved"
+        if saved == batches:
+            break
+    progress.close()
+
+
+## function to read the excel output, returns [(name, [hits])] in the order of the file
+def read_results(output_path):
+    results = []
+
+    for excel_path in sorted(glob.glob(os.path.join(output_path, "*.xlsx"))):
+        sheet = openpyxl.load_workbook(excel_path, read_only=True).active
+        for row in sheet.iter_rows(min_row=2, values_only=True):
+            if row[0]:
+                results.append((row[0], []))
+            results[-1][1].append(row[1:])
+
+    return results
+
+
+## function to read the names of the sequences that are marked as failed in the excel output
+def failed_names(output_path):
+    sheet = openpyxl.load_workbook(
+        glob.glob(os.path.join(output_path, "*.xlsx"))[0], read_only=True
+    ).active
+    position = next(sheet.iter_rows(values_only=True)).index("Status") - 1
+
+    return [
+        name
+        for name, hits in read_results(output_path)
+        if hits[0][position] == "Failed"
+    ]
+
+
+def test_duplicates_keep_the_order_of_the_fasta(server, tmp_path):
+    fasta_path = make_fasta(tmp_path, 60, duplicates=0.3)
+    identify(fasta_path, str(tmp_path))
+    records = list(fasta_reader.read_records(fasta_path))
+    results = read_results(str(tmp_path))
+
+    assert [name for name, sequence, end in records] == [
+        name for name, hits in results
+    ]
+
+    ## every duplicate gets the hits of the first occurrence of its sequence
+    first = {}
+    for (name, sequence, end), (result_name, hits) in zip(records, results):
+        assert first.setdefault(sequence, hits) == hits
+    assert len(first) < len(records)
+
+
+def test_cached_duplicates_keep_the_order_of_the_fasta(server, tmp_path):
+    fasta_path = make_fasta(tmp_path, 60, duplicates=0.3)
+    identify(fasta_path, str(tmp_path))
+    results = read_results(str(tmp_path))
+
+    ## the second run takes every page from the identification cache
+    checkpoint.reset(fasta_path, str(tmp_path))
+    messages = identify(fasta_path, str(tmp_path))
+
+    assert any(message.endswith(" 0 misses.") for message in messages)
+    assert read_results(str(tmp_path)) == results
+
+
+def test_resume_after_crash(server, tmp_path):
+    fasta_path = make_fasta(tmp_path, 100)
+    crash(fasta_path, str(tmp_path), 3)
+    finished = checkpoint.resume(fasta_path, str(tmp_path))["records"]
+
+    messages = identify(fasta_path, str(tmp_path))
+    records = list(fasta_reader.read_records(fasta_path))
+
+    assert 0 < finished < len(records)
+    assert RESTARTED not in messages
+    assert [name for name, sequence, end in records] == [
+        name for name, hits in read_results(str(tmp_path))
+    ]
+
+
+@pytest.mark.parametrize("change", ["backend", "missing"])
+def test_resume_starts_again_without_the_saved_results(server, tmp_path, change):
+    fasta_path = make_fasta(tmp_path, 100)
+    crash(fasta_path, str(tmp_path), 3)
+
+    ## the results of the journal are in another backend or were deleted
+    if change == "backend":
+        results_store.configure("parquet")
+    else:
+        os.remove(results_store.path(fasta_path, str(tmp_path)))
+
+    messages = identify(fasta_path, str(tmp_path))
+    records = list(fasta_reader.read_records(fasta_path))
+
+    assert RESTARTED in messages
+    assert [name for name, sequence, end in records] == [
+        name for name, hits in read_results(str(tmp_path))
+    ]
+
+
+def test_retry_failed(server, tmp_path, monkeypatch):
+    fasta_path = make_fasta(tmp_path, 30, duplicates=0)
+    arguments = [
+        "identify",
+        "--fasta",
+        fasta_path,
+        "--out",
+        str(tmp_path),
+        "--username",
+        "user",
+        "--password",
+        "password",
+        "--cache-path",
+        id_cache.path,
+    ]
+
+    ## there is nothing to retry before the first run
+    assert cli.identify(cli.parser().parse_args(arguments + ["--retry-failed"])) == 0
+    assert not os.path.isfile(checkpoint.journal_path(fasta_path, str(tmp_path)))
+
+    ## every third result page can not be downloaded in the first run
+    as_request, requests = markers.as_request, []
+
+    async def failing_request(marker, url, session, record=None):
+        requests.append(url)
+        if len(requests) % 3 == 0:
+            return None
+        return await as_request(marker, url, session, record)
+
+    monkeypatch.setattr(markers, "as_request", failing_request)
+    assert cli.identify(cli.parser().parse_args(arguments)) == 0
+    failed = checkpoint.read_failed(fasta_path, str(tmp_path))
+
+    assert len(failed) == 10
+    assert sorted(failed_names(str(tmp_path))) == sorted(
+        entry["name"] for entry in failed
+    )
+
+    ## the retry only requests the failed pages, the others come from the cache
+    requests.clear()
+
+    async def counted_request(marker, url, session, record=None):
+        requests.append(url)
+        return await as_request(marker, url, session, record)
+
+    monkeypatch.setattr(markers, "as_request", counted_request)
+    assert cli.identify(cli.parser().parse_args(arguments + ["--retry-failed"])) == 0
+
+    assert len(requests) == 10
+
+    assert checkpoint.read_failed(fasta_path, str(tmp_path)) == []
+    assert failed_names(str(tmp_path)) == []
+    assert [name for name, sequence, end in fasta_reader.read_records(fasta_path)] == [
+        name for name, hits in read_results(str(tmp_path))
+    ]